@@ -0,0 +1,170 @@
+"""
+Fingerprinted, precompressed copies of the data and export files.
+
+The site files keep their plain names (data/clubs.json, exports/*.xlsx,
+...), but browsers load copies whose names contain a hash of their
+content, so they can be cached forever:
+
+    data/assets/clubs.<hash>.json        (+ .gz, and .br if brotli is installed)
+    exports/assets/koerselstider_matrix.<hash>.xlsx
+    data/assets.json                     plain name -> current copy
+
+index.html reads data/assets.json (revalidated on every visit, so a
+repeat visit costs one small request) and falls back to the plain names
+when it is missing. The .gz/.br files sit next to the copies for hosts
+that serve precompressed variants (nginx gzip_static/brotli_static);
+vercel.json gets immutable cache headers for the copies and
+Content-Encoding headers for the variants. Copies referenced by the
+previous manifest are kept, so a page loaded just before a deploy can
+still fetch them; older ones are deleted.
+
+Run by build.py as the "assets" stage, or on its own:
+    python assets.py
+"""
+import gzip
+import hashlib
+import json
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # optional: only .gz variants without it
+    brotli = None
+
+BASE_DIR = Path(__file__).parent
+MANIFEST_PATH = "data/assets.json"
+ASSET_DIRS = {"data": "data/assets", "exports": "exports/assets"}
+# Plain files published as fingerprinted copies (row and delta files are already named by hash)
+PUBLISHED = [
+    "data/clubs.json",
+    "data/search_index.json",
+    "data/rows/manifest.json",
+    "data/deltas/index.json",
+    "data/matrix_index.json",
+    "data/matrix.bin",
+    "data/matrix.json",
+    "exports/koerselstider_matrix.csv",
+    "exports/koerselstider_matrix.xlsx",
+]
+# Not worth compressing (already zip) or too small to matter
+COMPRESS_MIN_BYTES = 1024
+NO_COMPRESS_SUFFIXES = {".xlsx"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def fingerprint_name(rel, body):
+    """Copy name for rel: "data/rows/manifest.json" -> "rows-manifest.<hash>.json"."""
+    path = Path(rel)
+    parent = path.parent.relative_to(path.parts[0]).as_posix()
+    stem = path.stem if parent == "." else f"{parent.replace('/', '-')}-{path.stem}"
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{path.suffix}"
+
+
+def write_if_missing(path, make):
+    """Write make() to path unless it exists; the name is a content hash, so it cannot be stale."""
+    if not path.exists():
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(make())
+        tmp.replace(path)
+
+
+def publish(base_dir=BASE_DIR, files=PUBLISHED):
+    """Write fingerprinted copies (and variants) of files and data/assets.json.
+
+    Returns the paths of the manifest and the copies.
+    """
+    base_dir = Path(base_dir)
+    manifest_path = base_dir / MANIFEST_PATH
+    previous = {}
+    if manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            previous = json.load(f).get("files", {})
+
+    entries = {}
+    for rel in files:
+        source = base_dir / rel
+        if not source.exists():
+            continue
+        body = source.read_bytes()
+        asset_dir = base_dir / ASSET_DIRS[Path(rel).parts[0]]
+        asset_dir.mkdir(parents=True, exist_ok=True)
+        copy = asset_dir / fingerprint_name(rel, body)
+        write_if_missing(copy, lambda: body)
+        entry = {"path": copy.relative_to(base_dir).as_posix(), "bytes": len(body)}
+        if len(body) >= COMPRESS_MIN_BYTES and source.suffix not in NO_COMPRESS_SUFFIXES:
+            gz = copy.with_name(copy.name + ".gz")
+            write_if_missing(gz, lambda: gzip.compress(body, compresslevel=9, mtime=0))
+            entry["gz_bytes"] = gz.stat().st_size
+            if brotli is not None:
+                br = copy.with_name(copy.name + ".br")
+                write_if_missing(br, lambda: brotli.compress(body, quality=11))
+                entry["br_bytes"] = br.stat().st_size
+        entries[rel] = entry
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "files": entries}, f, ensure_ascii=False, indent=1)
+
+    # Keep the current and previous generation, drop anything older
+    keep = {Path(e["path"]).name for e in list(entries.values()) + list(previous.values())}
+    removed = 0
+    for rel_dir in ASSET_DIRS.values():
+        asset_dir = base_dir / rel_dir
+        if not asset_dir.exists():
+            continue
+        for path in asset_dir.iterdir():
+            name = path.name.removesuffix(".gz").removesuffix(".br")
+            if name not in keep:
+                path.unlink()
+                removed += 1
+
+    total = sum(e["bytes"] for e in entries.values())
+    packed = sum(e.get("br_bytes", e.get("gz_bytes", e["bytes"])) for e in entries.values())
+    variants = ".gz and .br" if brotli is not None else ".gz (install brotli for .br)"
+    print(f"  Published {len(entries)} assets ({total} bytes, {packed} compressed with {variants}), "
+          f"removed {removed} old files")
+    update_vercel_headers(base_dir / "vercel.json")
+    return [manifest_path] + [base_dir / e["path"] for e in entries.values()]
+
+
+def cache_headers():
+    """vercel.json header rules for the fingerprinted copies, their variants and the manifest."""
+    rules = []
+    for rel_dir in ASSET_DIRS.values():
+        rules.append({"source": f"/{rel_dir}/(.*)", "headers": [{"key": "Cache-Control", "value": IMMUTABLE}]})
+        for suffix, encoding in (("gz", "gzip"), ("br", "br")):
+            rules.append({"source": f"/{rel_dir}/(.*)\\.{suffix}",
+                          "headers": [{"key": "Content-Encoding", "value": encoding},
+                                      {"key": "Cache-Control", "value": IMMUTABLE}]})
+    # Row and delta files are named by content hashes, so they can be cached forever too
+    rules.append({"source": "/data/rows/:file([0-9a-f]{16}\\.json)",
+                  "headers": [{"key": "Cache-Control", "value": IMMUTABLE}]})
+    rules.append({"source": "/data/deltas/:file([0-9a-f]{16}-[0-9a-f]{16}\\.json)",
+                  "headers": [{"key": "Cache-Control", "value": IMMUTABLE}]})
+    rules.append({"source": f"/{MANIFEST_PATH}",
+                  "headers": [{"key": "Cache-Control", "value": "public, max-age=0, must-revalidate"}]})
+    return rules
+
+
+def update_vercel_headers(path):
+    """Put the cache_headers() rules into vercel.json after the rules already there."""
+    path = Path(path)
+    config = {}
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    rules = cache_headers()
+    ours = {rule["source"] for rule in rules}
+    headers = [rule for rule in config.get("headers", []) if rule["source"] not in ours] + rules
+    if headers != config.get("headers"):
+        config["headers"] = headers
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+
+def main():
+    publish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Synthetic-scale benchmark of the whole pipeline.
+
+For each size (default 100, 1,000 and 5,000 clubs) a seeded fake club
+list is placed at random inside Denmark (boxes over Jylland, Fyn,
+Sjælland, Lolland-Falster and Bornholm) and run through the stages:
+
+    ingest      read_clubs() on the generated CSV
+    matrix      TileScheduler.compute() into a MatrixStore as in
+                fast_update.py, routed by the in-process StubBackend
+                (osrm_stub.py), or the stub HTTP server with --http
+    json_dump   store.to_dict() and json.dump() of matrix.json
+    save        the rest of save_matrix(): store .npy files, matrix.bin
+                and row files
+    export_load generate_exports.load_data() (store in club name order)
+    export_csv  generate_exports.py's CSV, converting rows as it writes
+    export_xlsx generate_exports.py's XLSX, converting rows as it writes
+
+Each stage reports wall time, the process's peak RSS after it (not on
+Windows, which lacks the resource module) and, with --memory, the peak
+traced allocation inside it (tracemalloc slows the
+stage down, so compare times between runs made with the same flags).
+Artifact sizes are recorded too. Results go to
+data/reports/bench_pipeline-<time>.json next to the run reports of
+metrics.py.
+
+The json_dump and export_xlsx stages grow with the number of cells, so
+the default run takes a while at 5,000 clubs (25 million cells).
+
+Usage:
+    python bench_pipeline.py
+    python bench_pipeline.py --sizes 100 1000 --memory
+    python bench_pipeline.py --sizes 5000 --skip export_xlsx
+"""
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import generate_exports
+from ingest import read_clubs, save_clubs
+from matrix_io import write_compact, write_rows
+from matrix_store import MatrixStore
+from metrics import REPORT_DIR
+from osrm_stub import StubBackend, make_server
+from routing import OSRMBackend
+from tiling import TileScheduler
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS, only the --memory tracemalloc peaks
+    resource = None
+
+BASE_DIR = Path(__file__).parent
+STAGES = ["ingest", "matrix", "json_dump", "save", "export_load", "export_csv", "export_xlsx"]
+
+# (south, north, west, east, weight, city) boxes that lie (mostly) on Danish land
+REGIONS = [
+    (54.90, 55.60, 8.70, 9.70, 12, "Sønderjylland"),
+    (55.60, 56.50, 8.40, 10.00, 20, "Midtjylland"),
+    (56.50, 57.40, 8.70, 10.30, 12, "Nordjylland"),
+    (55.10, 55.55, 9.90, 10.75, 10, "Fyn"),
+    (55.25, 55.95, 11.20, 12.20, 22, "Sjælland"),
+    (55.60, 55.90, 12.20, 12.55, 16, "Hovedstaden"),
+    (54.70, 54.90, 11.10, 11.95, 5, "Lolland-Falster"),
+    (55.00, 55.25, 14.75, 15.10, 3, "Bornholm"),
+]
+
+
+def fake_clubs(n, seed=0):
+    """n clubs with coordinates, as ({name, address, postal_code, city}, (lat, lon)) pairs."""
+    rng = random.Random(seed)
+    weights = [r[4] for r in REGIONS]
+    clubs = []
+    for i in range(n):
+        south, north, west, east, _, region = rng.choices(REGIONS, weights)[0]
+        lat, lon = round(rng.uniform(south, north), 6), round(rng.uniform(west, east), 6)
+        club = {"name": f"Syntetisk IF {i + 1:05d}", "address": f"Idrætsvej {rng.randint(1, 200)}",
+                "postal_code": str(rng.randint(1000, 9990)), "city": region}
+        clubs.append((club, (lat, lon)))
+    return clubs
+
+
+def write_clubs_csv(path, clubs):
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        f.write("Klub;Adresse;Postnummer;By\n")
+        for club, _ in clubs:
+            f.write(f"{club['name']};{club['address']};{club['postal_code']};{club['city']}\n")
+
+
+def peak_rss_mb():
+    """Peak RSS of the process in MB, or None where the resource module is missing."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def measure(fn, trace_memory):
+    """(result, {"seconds"[, "rss_peak_mb"][, "traced_peak_mb"]}) for fn()."""
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    stats = {"seconds": round(time.perf_counter() - started, 4)}
+    if trace_memory:
+        stats["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    rss = peak_rss_mb()
+    if rss is not None:
+        stats["rss_peak_mb"] = rss
+    return result, stats
+
+
+def dir_size(path):
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def run_size(n, work_dir, args, backend):
+    """Run every stage for n clubs in work_dir; returns the result dict."""
+    data_dir = work_dir / "data"
+    export_dir = work_dir / "exports"
+    data_dir.mkdir(parents=True)
+    clubs = fake_clubs(n, args.seed)
+    coords = {club["name"]: latlon for club, latlon in clubs}
+    csv_path = work_dir / "klubber.csv"
+    write_clubs_csv(csv_path, clubs)
+    result = {"clubs": n, "stages": {}, "artifacts": {}}
+
+    def stage(name, fn):
+        if name in args.skip:
+            result["stages"][name] = {"skipped": True}
+            return None
+        print(f"  [{name}]")
+        value, stats = measure(fn, args.memory)
+        result["stages"][name] = stats
+        memory = "".join(f", {label} {stats[key]} MB" for key, label in
+                         (("rss_peak_mb", "peak RSS"), ("traced_peak_mb", "traced peak")) if key in stats)
+        print(f"  [{name}] {stats['seconds']:.2f}s{memory}")
+        return value
+
+    def assemble():
+        names = [club["name"] for club in parsed]
+        store = MatrixStore(names)
+        points = [coords[name] for name in names]
+        scheduler = TileScheduler(backend, max_coords=args.max_coords, workers=args.workers, rate=0)
+
+        def store_cell(i, j, dur_sec, dist_m):
+            if dur_sec is not None and dist_m is not None:
+                store.set(i, j, dur_sec, dist_m)
+
+        failed = scheduler.compute(points, store_cell)
+        if failed:
+            raise RuntimeError(f"{len(failed)} tiles failed")
+        return store
+
+    def dump_json():
+        matrix = store.to_dict()
+        with open(data_dir / "matrix.json", "w", encoding="utf-8") as f:
+            json.dump(matrix, f, ensure_ascii=False)
+
+    def save_rest():
+        store.save(data_dir)
+        write_compact(store, data_dir)
+        write_rows(store, data_dir)
+
+    parsed = stage("ingest", lambda: read_clubs(csv_path))
+    if parsed is None:
+        parsed = [club for club, _ in clubs]
+    save_clubs(parsed, data_dir)
+    store = stage("matrix", assemble)
+    if store is None:
+        print("  matrix skipped, later stages need it")
+        return result
+    stage("json_dump", dump_json)
+    stage("save", save_rest)
+
+    export_dir.mkdir()
+    loaded = stage("export_load", lambda: generate_exports.load_data(data_dir))
+    if loaded:
+        exp_clubs, names, exp_store = loaded
+        stage("export_csv", lambda: generate_exports.write_csv(export_dir / "matrix.csv", names,
+                                                               generate_exports.minute_rows(exp_store)))
+        stage("export_xlsx", lambda: generate_exports.write_xlsx(export_dir / "matrix.xlsx", exp_clubs, names,
+                                                                 generate_exports.minute_rows(exp_store),
+                                                                 generate_exports.km_rows(exp_store)))
+
+    for label, path in (("clubs.csv", csv_path), ("clubs.json", data_dir / "clubs.json"),
+                        ("matrix.json", data_dir / "matrix.json"), ("matrix.bin", data_dir / "matrix.bin"),
+                        ("store", data_dir / "store"), ("rows", data_dir / "rows"),
+                        ("export.csv", export_dir / "matrix.csv"), ("export.xlsx", export_dir / "matrix.xlsx")):
+        if path.exists():
+            result["artifacts"][label] = dir_size(path)
+    result["routes"] = store.count()
+    return result
+
+
+def print_table(results):
+    print(f"\n{'stage':<14}" + "".join(f"{r['clubs']:>12,}" for r in results))
+    for name in STAGES:
+        cells = []
+        for r in results:
+            stats = r["stages"].get(name, {})
+            cells.append("skipped" if stats.get("skipped") else f"{stats['seconds']:.2f}s" if stats else "-")
+        print(f"{name:<14}" + "".join(f"{c:>12}" for c in cells))
+    for key, label in (("rss_peak_mb", "peak RSS MB"), ("traced_peak_mb", "traced MB")):
+        if any(key in s for r in results for s in r["stages"].values()):
+            print(f"{label:<14}" + "".join(
+                f"{max((s.get(key, 0) for s in r['stages'].values()), default=0):>12}" for r in results))
+    labels = list(dict.fromkeys(label for r in results for label in r["artifacts"]))
+    for label in labels:
+        print(f"{label:<14}" + "".join(f"{r['artifacts'].get(label, 0) / 2 ** 20:>10.1f}MB" for r in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic club lists")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", nargs="+", choices=STAGES, default=[], help="Stages to leave out")
+    parser.add_argument("--memory", action="store_true", help="Trace allocations per stage (slower)")
+    parser.add_argument("--http", action="store_true", help="Route through the stub HTTP server")
+    parser.add_argument("--max-coords", type=int, default=100, help="Coordinates per Table request")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--data-dir", default=str(BASE_DIR / "data"), help="Where the report is written")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated files")
+    args = parser.parse_args()
+
+    server = None
+    if args.http:
+        server = make_server(port=0, max_table_size=args.max_coords)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        backend = OSRMBackend(f"http://127.0.0.1:{server.server_address[1]}")
+    else:
+        backend = StubBackend()
+
+    started = datetime.now(timezone.utc)
+    results = []
+    work_root = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    try:
+        for n in args.sizes:
+            print(f"\n{n} clubs")
+            results.append(run_size(n, work_root / str(n), args, backend))
+    finally:
+        if server:
+            server.shutdown()
+        if args.keep:
+            print(f"\nGenerated files kept in {work_root}")
+        else:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    print_table(results)
+    report_dir = Path(args.data_dir) / REPORT_DIR
+    report_dir.mkdir(parents=True, exist_ok=True)
+    path = report_dir / f"bench_pipeline-{started.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"started": started.isoformat(timespec="seconds"), "argv": sys.argv[1:],
+                   "routing": "http stub" if args.http else "in-process stub", "results": results},
+                  f, ensure_ascii=False, indent=1)
+    print(f"\nReport: {path}")
+
+
+if __name__ == "__main__":
+    main()
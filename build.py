@@ -1,60 +1,288 @@
 """
 Build script for koerselstid-fodbold static site.
-Regenerates data/clubs.json from the source Excel file.
+
+Runs the pipeline as dependent stages and only reruns a stage when the
+content of its inputs changed since the last build:
+
+    clubs    Excel or CSV file   -> data/clubs.json
+    search   clubs               -> data/search_index.json (autocomplete,
+                                    see search_index.py)
+    coords   clubs               -> data/coords.json (geocoding)
+    matrix   clubs + coords      -> data/store/ (MatrixStore), exported as
+                                    data/matrix.json, matrix.bin,
+                                    matrix_index.json, data/rows/ and a
+                                    delta in data/deltas/ (OSRM)
+    exports  clubs + matrix      -> exports/*.csv and *.xlsx
+    assets   data + exports      -> fingerprinted, precompressed copies in
+                                    data/assets/ and exports/assets/,
+                                    listed in data/assets.json (assets.py)
+
+Input and output hashes are recorded in data/build_manifest.json. Inputs
+are hashed by content (clubs and coordinates as canonical JSON), so a
+reformatted clubs.json or an Excel file saved without changes does not
+trigger geocoding, routing or new exports. A stage also reruns when one
+of its outputs is missing or was edited by hand. The matrix stage only
+routes clubs whose coordinates changed since the matrix was built.
 
 Usage:
     python build.py --excel path/to/klubber.xlsx
+    python build.py                 # rebuild from data/clubs.json
 
 Optional:
     python build.py --excel path/to/klubber.xlsx --matrix path/to/driving_matrix.json
+    python build.py --dry-run       # only report which stages would run
+    python build.py --force matrix  # rerun a stage with unchanged inputs
+    PROFILE_STAGES=matrix python build.py   # cProfile the matrix stage
+
+Every run that is not a dry run writes a timing report to data/reports/
+(see metrics.py).
 """
 import json
 import argparse
+import hashlib
+import sys
+import time
 from pathlib import Path
 
-def read_excel(path):
-    """Read club data from Excel file."""
-    import openpyxl
-    wb = openpyxl.load_workbook(str(path))
-    ws = wb["Ark1"]
-    clubs = []
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=1, max_col=4, values_only=True):
-        if row[0]:
-            clubs.append({
-                "name": str(row[0]).strip(),
-                "address": str(row[1]).strip() if row[1] else "",
-                "postal_code": str(row[2]).strip() if row[2] else "",
-                "city": str(row[3]).strip() if row[3] else ""
-            })
-    return clubs
+import numpy as np
+
+import metrics
+from ingest import address_key, diff_clubs, load_clubs, read_clubs, save_clubs
+from matrix_io import DELTA_DIR, load_coords, save_coords, save_matrix
+from matrix_store import STORE_DIR, MatrixStore
+from search_index import INDEX_VERSION, write_search_index
+
+STAGES = ["clubs", "search", "coords", "matrix", "exports", "assets"]
+MANIFEST_NAME = "build_manifest.json"
+
+
+def file_hash(path):
+    """sha256 of a file's bytes, or None if it does not exist."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(obj):
+    """sha256 of obj as canonical JSON, independent of file formatting."""
+    text = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def coords_hash(coords):
+    return content_hash({name: [round(lat, 6), round(lon, 6)] for name, (lat, lon) in coords.items()})
+
+
+def club_address(club):
+    return "|".join(address_key(club))
+
+
+class BuildManifest:
+    """Per-stage input/output hashes of the last successful build."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.stages = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.stages = json.load(f).get("stages", {})
+
+    def stale_reason(self, stage, inputs, base_dir):
+        """Why stage must run, or None if its record matches inputs and outputs."""
+        record = self.stages.get(stage)
+        if record is None:
+            return "never built"
+        changed = sorted(k for k in set(inputs) | set(record["inputs"]) if inputs.get(k) != record["inputs"].get(k))
+        if changed:
+            return f"{', '.join(changed)} changed"
+        for rel, digest in record["outputs"].items():
+            if file_hash(base_dir / rel) != digest:
+                return f"{rel} missing or modified"
+        return None
+
+    def record(self, stage, inputs, outputs, base_dir, **extra):
+        self.stages[stage] = {
+            "inputs": inputs,
+            "outputs": {Path(p).relative_to(base_dir).as_posix(): file_hash(p) for p in outputs},
+            "built": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            **extra,
+        }
+        self.save()
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "stages": self.stages}, f, ensure_ascii=False, indent=1)
+
+
+def load_json(path, default=None):
+    if not Path(path).exists():
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_clubs(excel, data_dir):
+    clubs = read_clubs(excel)
+    print(f"  {len(clubs)} clubs in {Path(excel).name}")
+    diff_clubs(load_clubs(data_dir), clubs).report()
+    save_clubs(clubs, data_dir)
+    return [data_dir / "clubs.json"]
+
+
+def build_coords(clubs, data_dir, record):
+    """Geocode clubs, reusing coordinates of clubs whose address is unchanged."""
+    from geocoding import geocode_clubs
+
+    previous = load_coords(data_dir)
+    addresses = record.get("addresses") if record else None
+    if addresses is None:
+        # No snapshot yet (e.g. a fresh checkout without data/coords.json):
+        # nothing is known to have moved, so data/coords.json, the legacy
+        # name-keyed cache and KNOWN_COORDS are all used before geocoding
+        changed = set()
+    else:
+        changed = {c["name"] for c in clubs if addresses.get(c["name"]) != club_address(c)}
+    known = {name: latlon for name, latlon in previous.items() if name not in changed}
+    print(f"  {len(changed)} new or changed addresses")
+    coords = geocode_clubs(clubs, known=known, changed=changed)
+    print(f"  Total coords: {len(coords)}/{len(clubs)}")
+    save_coords(coords, data_dir)
+    return [data_dir / "coords.json"], {"addresses": {c["name"]: club_address(c) for c in clubs}}
+
+
+def build_matrix(clubs, coords, data_dir, record, matrix_source=None):
+    """Route clubs whose coordinates changed since the matrix was built."""
+    names = [c["name"] for c in clubs]
+    if matrix_source:
+        store = MatrixStore.from_dict(load_json(matrix_source), names)
+        print(f"  Imported {matrix_source} ({store.count()} routes)")
+    else:
+        from matrix_update import update_matrix
+
+        store = MatrixStore.load(data_dir)
+        removed = store.remove_clubs(set(store.names) - set(names))
+        if removed:
+            print(f"  Removed the routes of {removed} removed clubs")
+        store.reorder(names)
+
+        routed_with = record.get("coords") if record else None
+        if routed_with is None:
+            # No snapshot yet: assume the existing matrix matches the coordinates
+            no_routes = np.isnan(store.durations).all(axis=1)
+            changed = {name for name, empty in zip(names, no_routes.tolist()) if empty}
+        else:
+            # Includes clubs that lost their coordinates, so their old routes go
+            changed = {name for name in names if routed_with.get(name) !=
+                       (None if name not in coords else [round(v, 6) for v in coords[name]])}
+        new_routes, errors, failed_tiles = update_matrix(store, coords, changed)
+        if failed_tiles:
+            # Not saved; a rerun replays finished tiles from the journal
+            sys.exit("  ERROR: matrix stage incomplete, nothing saved; rerun build.py")
+        print(f"  {new_routes} new routes, {errors} errors, {store.count()} routes")
+        if errors:
+            print("  Run repair_matrix.py afterwards to fetch the missing routes")
+
+    save_matrix(store, data_dir)
+    outputs = [data_dir / STORE_DIR / "durations.npy", data_dir / STORE_DIR / "distances.npy",
+               data_dir / "matrix.json", data_dir / "matrix.bin", data_dir / "matrix_index.json",
+               data_dir / "rows" / "manifest.json", data_dir / DELTA_DIR / "index.json"]
+    snapshot = {name: [round(v, 6) for v in latlon] for name, latlon in coords.items()}
+    return outputs, {"coords": snapshot}
+
 
 def main():
     parser = argparse.ArgumentParser(description="Build static data files for koerselstid-fodbold")
-    parser.add_argument("--excel", required=True, help="Path to klubber.xlsx")
-    parser.add_argument("--matrix", help="Path to driving_matrix.json (optional, copies to data/matrix.json)")
+    parser.add_argument("--excel", help="Path to klubber.xlsx or a CSV export of it (default: keep data/clubs.json)")
+    parser.add_argument("--matrix", help="Path to driving_matrix.json (optional, imported instead of routing)")
+    parser.add_argument("--force", nargs="+", choices=STAGES + ["all"], default=[],
+                        help="Rerun these stages even if their inputs are unchanged")
+    parser.add_argument("--dry-run", action="store_true", help="Only report which stages would run")
     args = parser.parse_args()
 
     base_dir = Path(__file__).parent
     data_dir = base_dir / "data"
+    export_dir = base_dir / "exports"
     data_dir.mkdir(exist_ok=True)
+    manifest = BuildManifest(data_dir / MANIFEST_NAME)
+    forced = set(STAGES) if "all" in args.force else set(args.force)
+    upstream_ran = False
+    report = metrics.start_report("build", data_dir) if not args.dry_run else None
+
+    def should_run(stage, inputs):
+        nonlocal upstream_ran
+        if report:
+            report.end_stage()
+        reason = manifest.stale_reason(stage, inputs, base_dir)
+        if stage in forced:
+            reason = "forced"
+        elif reason is None and args.dry_run and upstream_ran:
+            reason = "upstream stage would run"
+        print(f"[{stage}] {'up to date' if reason is None else 'run: ' + reason}")
+        if reason is not None:
+            upstream_ran = True
+            if report:
+                report.stage(stage)
+        return reason is not None and not args.dry_run
+
+    if not args.excel and not (data_dir / "clubs.json").exists():
+        parser.error("--excel is required when data/clubs.json does not exist")
 
-    # Generate clubs.json
-    clubs = read_excel(args.excel)
-    clubs_path = data_dir / "clubs.json"
-    with open(clubs_path, "w", encoding="utf-8") as f:
-        json.dump(clubs, f, ensure_ascii=False, indent=2)
-    print(f"Generated {clubs_path} with {len(clubs)} clubs")
+    # clubs: Excel -> clubs.json
+    if args.excel:
+        inputs = {"excel": file_hash(args.excel)}
+        if should_run("clubs", inputs):
+            manifest.record("clubs", inputs, build_clubs(args.excel, data_dir), base_dir)
+    clubs = load_clubs(data_dir)
 
-    # Optionally copy matrix
+    # search: clubs -> search_index.json
+    inputs = {"clubs": content_hash(clubs), "version": INDEX_VERSION}
+    if should_run("search", inputs):
+        manifest.record("search", inputs, [write_search_index(clubs, data_dir)], base_dir)
+
+    # coords: clubs -> coords.json
+    from geocoding import KNOWN_COORDS
+    inputs = {"clubs": content_hash(clubs), "known_coords": content_hash(KNOWN_COORDS)}
+    if should_run("coords", inputs):
+        outputs, extra = build_coords(clubs, data_dir, manifest.stages.get("coords"))
+        manifest.record("coords", inputs, outputs, base_dir, **extra)
+    coords = load_coords(data_dir)
+
+    # matrix: clubs + coords -> matrix store, matrix.json, compact matrix and row shards
+    from matrix_update import radius_from_env
+    from routing import backend_from_env
+    inputs = {"clubs": content_hash([c["name"] for c in clubs]), "coords": coords_hash(coords),
+              "backend": backend_from_env().id}
+    if radius_from_env():
+        inputs["radius_m"] = radius_from_env()
     if args.matrix:
-        import shutil
-        matrix_dest = data_dir / "matrix.json"
-        shutil.copy2(args.matrix, matrix_dest)
-        with open(matrix_dest, "r", encoding="utf-8") as f:
-            matrix = json.load(f)
-        print(f"Copied matrix to {matrix_dest} ({len(matrix)} entries)")
+        inputs["matrix_source"] = file_hash(args.matrix)
+    if should_run("matrix", inputs):
+        outputs, extra = build_matrix(clubs, coords, data_dir, manifest.stages.get("matrix"), args.matrix)
+        manifest.record("matrix", inputs, outputs, base_dir, **extra)
+
+    # exports: clubs + matrix store -> CSV and XLSX
+    inputs = {"clubs": content_hash(clubs),
+              "durations": file_hash(data_dir / STORE_DIR / "durations.npy"),
+              "distances": file_hash(data_dir / STORE_DIR / "distances.npy")}
+    if should_run("exports", inputs):
+        import generate_exports
+        manifest.record("exports", inputs, generate_exports.generate(data_dir, export_dir), base_dir)
 
+    # assets: data and export files -> fingerprinted copies and data/assets.json
+    import assets
+    inputs = {rel: file_hash(base_dir / rel) for rel in assets.PUBLISHED}
+    if should_run("assets", inputs):
+        manifest.record("assets", inputs, assets.publish(base_dir), base_dir)
+
+    if report:
+        report.finish()
     print("Done!")
 
+
 if __name__ == "__main__":
     main()
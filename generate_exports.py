@@ -1,139 +1,203 @@
-"""Generate Excel and CSV export files from matrix.json and clubs.json."""
-import json
+"""Generate Excel and CSV export files from the matrix store and clubs.json.
+
+The matrix stays in the store's float32 arrays and is turned into minutes
+and km one row at a time, as the CSV and the workbook are written. The
+workbook is streamed with openpyxl's write-only mode: named styles are set
+only on the header row and club column, and the matrix cells are plain
+values coloured by a few conditional formatting rules per sheet, so time
+and memory stay flat as the club count grows.
+"""
 import csv
-import io
+import json
+from pathlib import Path
+
+import numpy as np
 import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-
-# Load data
-with open("data/clubs.json", "r", encoding="utf-8") as f:
-    clubs_data = json.load(f)
-
-with open("data/matrix.json", "r", encoding="utf-8") as f:
-    driving_matrix = json.load(f)
-
-club_names = sorted([c["name"] for c in clubs_data])
-print(f"Loaded {len(club_names)} clubs and {len(driving_matrix)} routes")
-
-# === Generate CSV ===
-output = io.StringIO()
-writer = csv.writer(output, delimiter=";")
-writer.writerow(["Klub"] + club_names)
-for cn1 in club_names:
-    row = [cn1]
-    for cn2 in club_names:
-        key = f"{cn1}|{cn2}"
-        if key in driving_matrix:
-            row.append(driving_matrix[key]["duration_min"])
-        else:
-            row.append("")
-    writer.writerow(row)
-
-with open("exports/koerselstider_matrix.csv", "w", encoding="utf-8-sig", newline="") as f:
-    f.write(output.getvalue())
-print("Generated exports/koerselstider_matrix.csv")
-
-# === Generate Excel ===
-wb = openpyxl.Workbook()
-
-header_font = Font(bold=True, size=10, color="FFFFFF")
-header_fill = PatternFill(start_color="2E7D32", end_color="2E7D32", fill_type="solid")
-cell_alignment = Alignment(horizontal="center", vertical="center")
-thin_border = Border(
-    left=Side(style='thin', color='D0D0D0'),
-    right=Side(style='thin', color='D0D0D0'),
-    top=Side(style='thin', color='D0D0D0'),
-    bottom=Side(style='thin', color='D0D0D0')
-)
-
-green_light = PatternFill(start_color="E8F5E9", end_color="E8F5E9", fill_type="solid")
-yellow_light = PatternFill(start_color="FFF9C4", end_color="FFF9C4", fill_type="solid")
-orange_light = PatternFill(start_color="FFE0B2", end_color="FFE0B2", fill_type="solid")
-red_light = PatternFill(start_color="FFCDD2", end_color="FFCDD2", fill_type="solid")
-gray_fill = PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
-
-# Sheet 1: Matrix (min)
-ws = wb.active
-ws.title = "Kørselstid Matrix (min)"
-
-ws.cell(row=1, column=1, value="Klub").font = header_font
-ws.cell(row=1, column=1).fill = header_fill
-ws.cell(row=1, column=1).alignment = cell_alignment
-
-for j, name in enumerate(club_names):
-    cell = ws.cell(row=1, column=j+2, value=name)
-    cell.font = header_font
-    cell.fill = header_fill
-    cell.alignment = Alignment(horizontal="center", vertical="center", text_rotation=90)
-
-for i, cn1 in enumerate(club_names):
-    name_cell = ws.cell(row=i+2, column=1, value=cn1)
-    name_cell.font = Font(bold=True, size=9)
-    name_cell.fill = green_light
-
-    for j, cn2 in enumerate(club_names):
-        key = f"{cn1}|{cn2}"
-        cell = ws.cell(row=i+2, column=j+2)
-        cell.alignment = cell_alignment
-        cell.border = thin_border
-
-        if cn1 == cn2:
-            cell.value = 0
-            cell.fill = gray_fill
-        elif key in driving_matrix:
-            mins = driving_matrix[key]["duration_min"]
-            cell.value = mins
-            if mins <= 15:
-                cell.fill = green_light
-            elif mins <= 30:
-                cell.fill = yellow_light
-            elif mins <= 45:
-                cell.fill = orange_light
-            else:
-                cell.fill = red_light
-
-ws.column_dimensions['A'].width = 25
-
-# Sheet 2: Club details
-ws2 = wb.create_sheet("Kluboversigt")
-headers2 = ["Klubnavn", "Adresse", "Postnummer", "By"]
-for j, h in enumerate(headers2):
-    cell = ws2.cell(row=1, column=j+1, value=h)
-    cell.font = header_font
-    cell.fill = header_fill
-
-for i, club in enumerate(clubs_data):
-    ws2.cell(row=i+2, column=1, value=club["name"])
-    ws2.cell(row=i+2, column=2, value=club["address"])
-    ws2.cell(row=i+2, column=3, value=club["postal_code"])
-    ws2.cell(row=i+2, column=4, value=club["city"])
-
-for col_letter in ['A', 'B', 'C', 'D']:
-    ws2.column_dimensions[col_letter].width = 30
-
-# Sheet 3: Distance (km)
-ws3 = wb.create_sheet("Afstand (km)")
-
-ws3.cell(row=1, column=1, value="Klub").font = header_font
-ws3.cell(row=1, column=1).fill = header_fill
-
-for j, name in enumerate(club_names):
-    cell = ws3.cell(row=1, column=j+2, value=name)
-    cell.font = header_font
-    cell.fill = header_fill
-    cell.alignment = Alignment(horizontal="center", vertical="center", text_rotation=90)
-
-for i, cn1 in enumerate(club_names):
-    ws3.cell(row=i+2, column=1, value=cn1).font = Font(bold=True, size=9)
-    for j, cn2 in enumerate(club_names):
-        key = f"{cn1}|{cn2}"
-        cell = ws3.cell(row=i+2, column=j+2)
-        cell.alignment = cell_alignment
-        if key in driving_matrix:
-            cell.value = driving_matrix[key]["distance_km"]
-
-ws3.column_dimensions['A'].width = 25
-
-wb.save("exports/koerselstider_matrix.xlsx")
-print("Generated exports/koerselstider_matrix.xlsx")
-print("Done!")
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import Rule
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.styles.differential import DifferentialStyle
+from openpyxl.utils import get_column_letter
+
+import metrics
+from matrix_io import BAND_MINUTES
+from matrix_store import MatrixStore
+
+BASE_DIR = Path(__file__).parent
+
+# Colour bands shared with index.html (minutes, upper bound inclusive)
+BANDS = list(zip(BAND_MINUTES, ["E8F5E9", "FFF9C4", "FFE0B2"]))
+BAND_OVER = "FFCDD2"
+HEADER_COLOR = "2E7D32"
+SELF_COLOR = "E0E0E0"
+# Cell text for routes not computed in radius mode (see matrix_update.py)
+NOT_COMPUTED = "-"
+NOT_COMPUTED_COLOR = "FAFAFA"
+
+
+def load_data(data_dir):
+    """Clubs, sorted club names and the matrix store in the order of the names.
+
+    Returns (clubs, names, store); minute_rows(store) and km_rows(store)
+    give the cell values.
+    """
+    with open(data_dir / "clubs.json", "r", encoding="utf-8") as f:
+        clubs = json.load(f)
+    store = MatrixStore.load(data_dir)
+
+    names = sorted(c["name"] for c in clubs)
+    store.reorder(names)
+    print(f"Loaded {len(names)} clubs and {store.count()} routes")
+    return clubs, names, store
+
+
+def cell_values(row, dtype):
+    """One matrix row as a list of dtype values, None (no route) or NOT_COMPUTED (+inf)."""
+    finite = np.isfinite(row)
+    values = np.where(finite, row, 0).astype(dtype).tolist()
+    for j in np.flatnonzero(~finite):
+        values[j] = None if np.isnan(row[j]) else NOT_COMPUTED
+    return values
+
+
+def minute_rows(store):
+    """Rows of the store in whole minutes, rounded as duration_min in matrix.json."""
+    for row in store.durations:
+        yield cell_values(np.rint(row.astype(np.float64) / 60), np.int64)
+
+
+def km_rows(store):
+    """Rows of the store in km with one decimal, as distance_km in matrix.json."""
+    for row in store.distances:
+        yield cell_values(np.round(row.astype(np.float64) / 1000, 1), np.float64)
+
+
+def solid(color):
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+
+def add_named_styles(wb):
+    """Register the export styles once; cells then refer to them by name."""
+    center = Alignment(horizontal="center", vertical="center")
+
+    styles = [
+        NamedStyle("header", font=Font(bold=True, size=10, color="FFFFFF"),
+                   fill=solid(HEADER_COLOR), alignment=center),
+        NamedStyle("header_rotated", font=Font(bold=True, size=10, color="FFFFFF"), fill=solid(HEADER_COLOR),
+                   alignment=Alignment(horizontal="center", vertical="center", text_rotation=90)),
+        NamedStyle("header_plain", font=Font(bold=True, size=10, color="FFFFFF"), fill=solid(HEADER_COLOR)),
+        NamedStyle("club", font=Font(bold=True, size=9), fill=solid(BANDS[0][1])),
+        NamedStyle("club_plain", font=Font(bold=True, size=9)),
+        NamedStyle("cell_plain", alignment=center),
+    ]
+    for style in styles:
+        wb.add_named_style(style)
+
+
+class StyledCells:
+    """Make write-only cells with a named style (headers and labels, not matrix cells)."""
+
+    def __init__(self, ws):
+        self.ws = ws
+
+    def __call__(self, value, style):
+        cell = WriteOnlyCell(self.ws, value=value)
+        cell.style = style
+        return cell
+
+
+def add_band_rules(ws, n):
+    """Colour the n x n matrix from B2 by conditional formatting: the diagonal,
+    not computed cells and the 15/30/45-minute bands, each with a grid border."""
+    thin = Side(style="thin", color="D0D0D0")
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    ref = f"B2:{get_column_letter(n + 1)}{n + 1}"
+    # The first matching rule wins; empty cells (no route) match none
+    rules = [("ROW()=COLUMN()", SELF_COLOR, None),
+             (f'B2="{NOT_COMPUTED}"', NOT_COMPUTED_COLOR, Font(color="9E9E9E"))]
+    rules += [(f"AND(ISNUMBER(B2),B2<={limit})", color, None) for limit, color in BANDS]
+    rules.append(("ISNUMBER(B2)", BAND_OVER, None))
+    for formula, color, font in rules:
+        # Excel takes the fill colour of a differential style from bgColor
+        style = DifferentialStyle(fill=PatternFill(bgColor=color), font=font, border=border)
+        ws.conditional_formatting.add(ref, Rule(type="expression", formula=[formula], dxf=style, stopIfTrue=True))
+
+
+def write_matrix_sheet(wb, title, names, values, banded):
+    """Stream one N x N sheet from an iterable of rows.
+
+    The cells are plain values (empty without a route); banded sheets
+    get the 15/30/45-minute colours and a grid from add_band_rules().
+    """
+    ws = wb.create_sheet(title)
+    styled = StyledCells(ws)
+    ws.column_dimensions["A"].width = 25
+    ws.append([styled("Klub", "header" if banded else "header_plain")] +
+              [styled(name, "header_rotated") for name in names])
+    club_style = "club" if banded else "club_plain"
+    for name, row in zip(names, values):
+        ws.append([styled(name, club_style)] + row)
+    if banded:
+        add_band_rules(ws, len(names))
+    return ws
+
+
+def write_clubs_sheet(wb, clubs):
+    ws = wb.create_sheet("Kluboversigt")
+    for col_letter in ["A", "B", "C", "D"]:
+        ws.column_dimensions[col_letter].width = 30
+    styled = StyledCells(ws)
+    ws.append([styled(h, "header_plain") for h in ["Klubnavn", "Adresse", "Postnummer", "By"]])
+    for club in clubs:
+        ws.append([club["name"], club["address"], club["postal_code"], club["city"]])
+
+
+def write_csv(path, names, minutes):
+    """Semicolon CSV of minutes, an iterable of rows (see minute_rows())."""
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["Klub"] + names)
+        for name, row in zip(names, minutes):
+            writer.writerow([name] + ["" if v is None else v for v in row])
+
+
+def write_xlsx(path, clubs, names, minutes, km):
+    """Workbook with the minutes and km sheets, each an iterable of rows read once."""
+    wb = openpyxl.Workbook(write_only=True)
+    add_named_styles(wb)
+    write_matrix_sheet(wb, "Kørselstid Matrix (min)", names, minutes, banded=True)
+    write_clubs_sheet(wb, clubs)
+    write_matrix_sheet(wb, "Afstand (km)", names, km, banded=False)
+    wb.save(path)
+
+
+def generate(data_dir, export_dir):
+    """Write the CSV and XLSX exports; returns their paths."""
+    export_dir.mkdir(exist_ok=True)
+    with metrics.span("export.load"):
+        clubs, names, store = load_data(data_dir)
+
+    csv_path = export_dir / "koerselstider_matrix.csv"
+    with metrics.span("export.csv") as span:
+        write_csv(csv_path, names, minute_rows(store))
+        span["bytes"] = csv_path.stat().st_size
+    print(f"Generated exports/{csv_path.name}")
+
+    xlsx_path = export_dir / "koerselstider_matrix.xlsx"
+    with metrics.span("export.xlsx") as span:
+        write_xlsx(xlsx_path, clubs, names, minute_rows(store), km_rows(store))
+        span["bytes"] = xlsx_path.stat().st_size
+    print(f"Generated exports/{xlsx_path.name}")
+    return [csv_path, xlsx_path]
+
+
+def main():
+    report = metrics.start_report("generate_exports", BASE_DIR / "data")
+    report.stage("exports")
+    generate(BASE_DIR / "data", BASE_DIR / "exports")
+    report.finish()
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
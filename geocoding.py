@@ -0,0 +1,261 @@
+"""
+Geocoding shared by fast_update.py and full_update.py.
+
+Results are cached by normalized address (not club name) in
+cache/geocode_cache.json with the provider and fetch time, and expire
+after GEOCODE_TTL_DAYS. Requests run on a few threads over keep-alive
+connections, paced by a token bucket at exactly the provider's allowed
+rate instead of a fixed sleep after every call. Failed requests are
+retried through the same bucket: connection errors and 5xx answers
+after a growing backoff, 429 Too Many Requests after the server's
+Retry-After, which holds back every thread. Other 4xx answers are not
+retried.
+
+Configured with environment variables:
+
+    NOMINATIM_URL     base URL (default https://nominatim.openstreetmap.org)
+    NOMINATIM_RATE    requests per second (default 1, the public usage
+                      policy; raise it for a self-hosted Nominatim)
+    GEOCODE_WORKERS   concurrent requests (default 2)
+    GEOCODE_TTL_DAYS  cache lifetime in days (default 365)
+"""
+import http.client
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+import metrics
+from ratelimit import TokenBucket
+
+DEFAULT_URL = "https://nominatim.openstreetmap.org"
+USER_AGENT = "KoerselstidFodbold/1.0"
+CACHE_PATH = Path(__file__).parent / "cache" / "geocode_cache.json"
+# Name-keyed cache used by earlier versions of the update scripts
+LEGACY_CACHE_PATH = Path(__file__).parent / ".." / "Kørselstid mellem klubber program" / "cache" / "geocode_cache.json"
+
+# Hardcoded coords for known problem cases
+KNOWN_COORDS = {
+    "Aarslev BK": (55.308319, 10.490157),  # Fyn, not Aarhus
+    "DBU Fyn": (55.3954, 10.3516),  # Stadionvej 50, 5200 Odense V (same as BK2020)
+    "F.C. Lange Bolde": (55.4120, 10.3640),  # Rugårdsvej 242, 5210 Odense NV
+    "FC Avrasya": (55.3990, 10.3970),  # Risingvej 25, 5000 Odense C
+    "FC Hjallese": (55.3970, 10.3900),  # Schacksgade 14, 5000 Odense C
+    "FIUK, Odense": (55.4200, 10.4250),  # Risingevej 122, 5240 Odense NØ
+    "Get2Sport": (55.4120, 10.4130),  # Vollsmose Alle 20, 5240 Odense NØ
+    "Rise S & IF": (54.8850, 10.3730),  # St. Rise Skolevej, 5970 Ærøskøbing
+}
+
+
+def retry_after_seconds(value, default):
+    """Seconds asked for by a Retry-After header (delay or HTTP date), else default."""
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return default
+
+
+def normalize_address(address):
+    """Cache key for an address: NFC, casefolded, punctuation and spaces collapsed."""
+    text = unicodedata.normalize("NFC", address).casefold()
+    text = re.sub(r"[^\w]+", " ", text)
+    return " ".join(text.split())
+
+
+def club_queries(club):
+    """Search strings to try for a club, most specific first."""
+    return [f"{club['address']}, {club['postal_code']} {club['city']}, Danmark",
+            f"{club['address']}, {club['city']}, Danmark"]
+
+
+class GeocodeCache:
+    def __init__(self, path=CACHE_PATH, ttl_days=365):
+        self.path = Path(path)
+        self.ttl = ttl_days * 86400
+        self.entries = {}
+        self.lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, address):
+        """(lat, lon) for an address if cached and not expired, else None."""
+        entry = self.entries.get(normalize_address(address))
+        if entry is None or time.time() - entry.get("fetched", 0) > self.ttl:
+            return None
+        return entry["lat"], entry["lon"]
+
+    def put(self, address, lat, lon, provider, display_name=""):
+        with self.lock:
+            self.entries[normalize_address(address)] = {
+                "lat": lat, "lon": lon, "display_name": display_name,
+                "provider": provider, "fetched": time.time()
+            }
+
+    def import_legacy(self, clubs, path=LEGACY_CACHE_PATH):
+        """Copy entries from the old name-keyed cache under the clubs' addresses."""
+        path = Path(path)
+        if not path.exists():
+            return 0
+        with open(path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        imported = 0
+        for club in clubs:
+            old = legacy.get(club["name"])
+            query = club_queries(club)[0]
+            if old and self.get(query) is None:
+                self.put(query, float(old["lat"]), float(old["lon"]), "legacy", old.get("display_name", ""))
+                imported += 1
+        return imported
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=1)
+
+
+class NominatimGeocoder:
+    """Nominatim search client with a shared rate limit and keep-alive connections."""
+
+    def __init__(self, base_url=DEFAULT_URL, rate=1.0, workers=2, timeout=15,
+                 retries=2, backoff=2.0, max_retry_after=120):
+        parts = urllib.parse.urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.path = parts.path.rstrip("/")
+        self.provider = f"nominatim:{self.host}"
+        self.limiter = TokenBucket(rate, burst=1)
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            conn = self.local.conn = cls(self.host, timeout=self.timeout)
+        return conn
+
+    def _get_json(self, url):
+        """GET url and decode the JSON answer; every attempt takes a token."""
+        for attempt in range(self.retries + 1):
+            metrics.count("geocode.rate_limit_wait_s", self.limiter.acquire())
+            conn = self._connection()
+            started = time.perf_counter()
+            try:
+                conn.request("GET", url, headers={"User-Agent": USER_AGENT})
+                resp = conn.getresponse()
+                body = resp.read()
+            except (http.client.HTTPException, OSError):
+                metrics.record("geocode.search", time.perf_counter() - started, errors=1)
+                # Drop the (possibly stale keep-alive) connection
+                conn.close()
+                self.local.conn = None
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * (attempt + 1)
+            else:
+                if resp.status == 200:
+                    metrics.record("geocode.search", time.perf_counter() - started, bytes=len(body))
+                    return json.loads(body.decode())
+                metrics.record("geocode.search", time.perf_counter() - started, errors=1)
+                if (resp.status != 429 and resp.status < 500) or attempt == self.retries:
+                    raise http.client.HTTPException(f"HTTP {resp.status}")
+                delay = self.backoff * (attempt + 1)
+                if resp.status == 429:
+                    delay = retry_after_seconds(resp.getheader("Retry-After"), delay)
+                    if delay > self.max_retry_after:
+                        raise http.client.HTTPException(f"HTTP 429, Retry-After {delay:.0f}s")
+            metrics.count("geocode.retries")
+            metrics.count("geocode.backoff_s", delay)
+            self.limiter.pause(delay)
+
+    def search(self, query):
+        """(lat, lon, display_name) for a free-text query, or None."""
+        params = urllib.parse.urlencode({"q": query, "format": "json", "limit": 1, "countrycodes": "dk"})
+        data = self._get_json(f"{self.path}/search?{params}")
+        if data:
+            return float(data[0]["lat"]), float(data[0]["lon"]), data[0].get("display_name", "")
+        return None
+
+
+def geocoder_from_env():
+    """Create the geocoder configured by NOMINATIM_URL / NOMINATIM_RATE / GEOCODE_WORKERS."""
+    return NominatimGeocoder(
+        base_url=os.environ.get("NOMINATIM_URL", DEFAULT_URL),
+        rate=float(os.environ.get("NOMINATIM_RATE", "1")),
+        workers=int(os.environ.get("GEOCODE_WORKERS", "2")),
+    )
+
+
+def geocode_clubs(clubs, known=None, geocoder=None, cache=None, changed=()):
+    """Coordinates for clubs as {name: (lat, lon)}.
+
+    Uses known coordinates first (KNOWN_COORDS plus any passed in), then
+    the address cache, and geocodes the rest concurrently. Clubs named in
+    changed have a new address, so their old name-keyed entries are not
+    imported.
+    """
+    known = {**(known or {}), **KNOWN_COORDS}
+    geocoder = geocoder or geocoder_from_env()
+    cache = cache or GeocodeCache(ttl_days=float(os.environ.get("GEOCODE_TTL_DAYS", "365")))
+    imported = cache.import_legacy([c for c in clubs if c["name"] not in changed])
+    if imported:
+        print(f"  Imported {imported} entries from the old name-keyed geocode cache")
+
+    coords = {}
+    todo = []
+    for club in clubs:
+        name = club["name"]
+        if name in known:
+            coords[name] = tuple(known[name])
+            continue
+        cached = next((hit for hit in map(cache.get, club_queries(club)) if hit), None)
+        if cached:
+            coords[name] = cached
+        else:
+            todo.append(club)
+    print(f"  {len(coords)} from cache/known, {len(todo)} need geocoding")
+
+    def lookup(club):
+        for query in club_queries(club):
+            try:
+                hit = geocoder.search(query)
+            except Exception as e:
+                print(f"  Geocode error for {club['name']}: {e}")
+                continue
+            if hit:
+                lat, lon, display = hit
+                cache.put(query, lat, lon, geocoder.provider, display)
+                return lat, lon, display
+        return None
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=geocoder.workers) as pool:
+        for club, hit in zip(todo, pool.map(lookup, todo)):
+            if hit:
+                coords[club["name"]] = hit[:2]
+                print(f"  {club['name']}: {hit[0]:.4f}, {hit[1]:.4f} ({hit[2][:60]})")
+            else:
+                print(f"  WARNING: Could not geocode {club['name']}")
+    if todo:
+        print(f"  Geocoding {len(todo)} clubs took {time.monotonic() - started:.1f}s")
+
+    cache.save()
+    return coords
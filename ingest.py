@@ -0,0 +1,146 @@
+"""
+Read the club list from Excel or CSV, shared by build.py, fast_update.py
+and full_update.py.
+
+Workbooks are streamed with openpyxl's read-only mode. The first four
+columns are name, address, postal code and city, with one header row;
+CSV files may use ';' or ',' as delimiter. Postal codes are normalized
+the same way for every source (5000, 5000.0 and " 5000 " all become
+"5000"), and diff_clubs() reports which clubs were added, removed or
+got a new address compared with data/clubs.json.
+"""
+import csv
+import json
+from pathlib import Path
+
+from search_index import write_search_index
+
+DEFAULT_SHEET = "Ark1"
+
+
+def clean(value):
+    return "" if value is None else str(value).strip()
+
+
+def normalize_postal(value):
+    """Postal code as a string of digits where possible ("5000.0" -> "5000")."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = clean(value).replace(" ", "")
+    if text.endswith(".0") and text[:-2].isdigit():
+        text = text[:-2]
+    return text
+
+
+def iter_excel_rows(path, sheet=DEFAULT_SHEET):
+    import openpyxl
+    wb = openpyxl.load_workbook(str(path), read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet in wb.sheetnames else wb.active
+        yield from ws.iter_rows(min_row=2, max_col=4, values_only=True)
+    finally:
+        wb.close()
+
+
+def iter_csv_rows(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=";,").delimiter
+        except csv.Error:
+            delimiter = ";"
+        reader = csv.reader(f, delimiter=delimiter)
+        next(reader, None)
+        for row in reader:
+            yield (row + [None] * 4)[:4]
+
+
+def read_clubs(path, sheet=DEFAULT_SHEET):
+    """Normalized clubs from an .xlsx/.xlsm or .csv file.
+
+    Rows without a name are skipped; a repeated name keeps its first row.
+    """
+    path = Path(path)
+    rows = iter_csv_rows(path) if path.suffix.lower() == ".csv" else iter_excel_rows(path, sheet)
+    clubs = []
+    seen = set()
+    for row in rows:
+        row = tuple(row) + (None,) * (4 - len(row))
+        name = clean(row[0])
+        if not name:
+            continue
+        if name in seen:
+            print(f"  WARNING: {name} is listed more than once, keeping the first row")
+            continue
+        seen.add(name)
+        clubs.append({
+            "name": name,
+            "address": clean(row[1]),
+            "postal_code": normalize_postal(row[2]),
+            "city": clean(row[3]),
+        })
+    return clubs
+
+
+def address_key(club):
+    """(address, postal code, city) of a club, normalized for comparison."""
+    return clean(club.get("address")), normalize_postal(club.get("postal_code")), clean(club.get("city"))
+
+
+def load_clubs(data_dir):
+    """Clubs from data_dir/clubs.json, or [] if it does not exist."""
+    path = Path(data_dir) / "clubs.json"
+    if not path.exists():
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_clubs(clubs, data_dir):
+    """Write data_dir/clubs.json and its search index."""
+    path = Path(data_dir) / "clubs.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(clubs, f, ensure_ascii=False, indent=2)
+    write_search_index(clubs, data_dir)
+    print(f"  Saved {path} ({len(clubs)} clubs) and its search index")
+
+
+class ClubDiff:
+    """Names of clubs added, removed and with a changed address."""
+
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    @property
+    def needs_geocoding(self):
+        """Clubs that are new or have a new address."""
+        return set(self.added) | set(self.changed)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self):
+        return f"{len(self.added)} added, {len(self.removed)} removed, {len(self.changed)} with a new address"
+
+    def report(self, limit=20):
+        """Print the summary and up to limit rows of each kind."""
+        print(f"  {self.summary()}")
+        for mark, names in (("+", self.added), ("-", self.removed), ("~", self.changed)):
+            for name in names[:limit]:
+                print(f"    {mark} {name}")
+            if len(names) > limit:
+                print(f"    {mark} ... {len(names) - limit} more")
+
+
+def diff_clubs(old, new):
+    """ClubDiff from the old club list to the new one."""
+    old_map = {c["name"]: c for c in old}
+    new_map = {c["name"]: c for c in new}
+    added = [name for name in new_map if name not in old_map]
+    removed = [name for name in old_map if name not in new_map]
+    changed = [name for name, club in new_map.items()
+               if name in old_map and address_key(club) != address_key(old_map[name])]
+    return ClubDiff(added, removed, changed)
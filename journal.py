@@ -0,0 +1,66 @@
+"""
+Append-only journal of finished Table tiles, so long matrix runs can resume.
+
+Each line holds one tile's durations and distances under a key derived
+from the backend and the tile's source/destination coordinates. A rerun
+with the same inputs finds its finished tiles here and only fetches the
+missing ones. A line cut short by a crash is ignored on load and cut
+off the file, so the next tile starts on a line of its own.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+JOURNAL_PATH = Path(__file__).parent / "cache" / "matrix_journal.jsonl"
+
+
+def tile_key(backend_id, points, tile):
+    """Stable key for a tile: backend plus source and destination coordinates."""
+    def fmt(indices):
+        return ";".join(f"{points[i][0]:.6f},{points[i][1]:.6f}" for i in indices)
+    raw = f"{backend_id}|{fmt(tile.sources)}|{fmt(tile.destinations)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class TileJournal:
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            complete = 0  # bytes up to the last newline
+            with open(self.path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # partial last line from an interrupted run
+                    complete += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry["key"]] = (entry["durations"], entry["distances"])
+            if complete < self.path.stat().st_size:
+                with open(self.path, "r+b") as f:
+                    f.truncate(complete)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """(durations, distances) for a finished tile, or None."""
+        return self.entries.get(key)
+
+    def append(self, key, durations, distances):
+        """Record a finished tile and flush it to disk immediately."""
+        self.entries[key] = (durations, distances)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "durations": durations, "distances": distances}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        """Forget all tiles (after a complete run)."""
+        self.entries = {}
+        if self.path.exists():
+            self.path.unlink()
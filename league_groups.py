@@ -0,0 +1,336 @@
+"""
+Split teams into k league groups with as little driving as possible.
+
+Every pair of teams in a group meets home and away, so the cost of a
+pair is their round trip W[i, j] = time(i -> j) + time(j -> i). Two
+objectives are supported:
+
+    total   sum of W over all pairs within a group, summed over groups
+    max     the largest group total (fairest split), ties broken by total
+
+The search keeps C[i, g] = sum of W[i, j] over the teams j in group g, so
+the cost change of every single move (team to another group) and every
+swap (two teams trade groups) is one vectorized expression over all
+teams; the best improving move is applied and C is updated in O(N).
+Starts are seeded k-medoids++ style and filled greedily under the size
+limits; new starts run until the time budget is used up (a start still
+descending at the deadline stops there) and the best grouping is kept.
+Pairs without a known route cost twice the longest known round trip, so
+they are avoided but never block a grouping.
+
+Python:
+    grouping = optimize_groups(MatrixStore.load("data"), teams, k=8, time_budget=5)
+    grouping.groups
+
+CLI (writes exports/puljer.xlsx and exports/puljer.csv):
+    python league_groups.py --groups 8
+    python league_groups.py --teams hold.txt --groups 6 --min-size 8 --max-size 10 --objective max
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+
+from generate_exports import StyledCells, add_named_styles, write_matrix_sheet
+from matrix_store import MatrixStore
+
+BASE_DIR = Path(__file__).parent
+OBJECTIVES = ("total", "max")
+
+
+class Grouping:
+    """Teams per group, with the round-trip minutes of each group."""
+
+    def __init__(self, groups, group_costs, objective, starts):
+        self.groups = groups
+        self.group_costs = group_costs
+        self.objective = objective
+        self.starts = starts
+
+    @property
+    def total(self):
+        return sum(self.group_costs)
+
+    @property
+    def worst(self):
+        return max(self.group_costs)
+
+    def summary(self):
+        return (f"{len(self.groups)} groups, total {self.total / 60:.0f} min, "
+                f"largest group {self.worst / 60:.0f} min ({self.starts} starts)")
+
+
+def pair_costs(store, teams):
+    """Round-trip seconds between teams as a float64 matrix with a zero diagonal."""
+    idx = np.array([store.index[name] for name in teams], dtype=np.intp)
+    times = np.asarray(store.durations, dtype=np.float64)[np.ix_(idx, idx)]
+    w = times + times.T
+    known = np.isfinite(w)
+    w[~known] = 2 * w[known].max() if known.any() else 1.0
+    np.fill_diagonal(w, 0)
+    return w
+
+
+def size_limits(n, k, min_size=None, max_size=None):
+    """(min, max) group size, balanced by default; ValueError if infeasible."""
+    if k < 1 or k > n:
+        raise ValueError(f"Cannot split {n} teams into {k} groups")
+    lo = n // k if min_size is None else min_size
+    hi = -(-n // k) if max_size is None else max_size
+    if lo > hi or k * lo > n or k * hi < n:
+        raise ValueError(f"{n} teams do not fit in {k} groups of {lo}-{hi} teams")
+    return lo, hi
+
+
+class _Search:
+    """Local search state for one start: assignment, group sizes and C."""
+
+    def __init__(self, w, k, lo, hi, objective, assign):
+        self.w, self.k, self.lo, self.hi, self.objective = w, k, lo, hi, objective
+        self.assign = assign
+        self.sizes = np.bincount(assign, minlength=k)
+        self.c = np.zeros((len(w), k))
+        for g in range(k):
+            self.c[:, g] = w[:, assign == g].sum(axis=1)
+
+    def group_costs(self):
+        own = self.c[np.arange(len(self.w)), self.assign]
+        return np.bincount(self.assign, weights=own, minlength=self.k) / 2
+
+    def move(self, i, g):
+        old = self.assign[i]
+        self.c[:, old] -= self.w[:, i]
+        self.c[:, g] += self.w[:, i]
+        self.sizes[old] -= 1
+        self.sizes[g] += 1
+        self.assign[i] = g
+
+    def _others_max(self, costs):
+        """m[a, b] = largest group cost outside groups a and b."""
+        k = self.k
+        masked = np.broadcast_to(costs, (k, k, k)).copy()
+        ar = np.arange(k)
+        masked[ar, :, ar] = -np.inf
+        masked[:, ar, ar] = -np.inf
+        return masked.max(axis=2)
+
+    def best_step(self):
+        """Apply the best improving move or swap; False when at a local optimum."""
+        n = len(self.w)
+        a = self.assign
+        rows = np.arange(n)
+        own = self.c[rows, a]
+
+        # Moves: team i to group g
+        move_delta = self.c - own[:, None]
+        allowed = (self.sizes[None, :] < self.hi) & (self.sizes[a] > self.lo)[:, None]
+        allowed[rows, a] = False
+        # Swaps: i and j trade groups
+        cross = self.c[:, a]  # cross[i, j] = C[i, group of j]
+        swap_delta = cross - own[:, None] + cross.T - own[None, :] - 2 * self.w
+        swap_ok = a[:, None] < a[None, :]
+
+        if self.objective == "total":
+            move_delta = np.where(allowed, move_delta, np.inf)
+            swap_delta = np.where(swap_ok, swap_delta, np.inf)
+            i_m, g_m = np.unravel_index(np.argmin(move_delta), move_delta.shape)
+            i_s, j_s = np.unravel_index(np.argmin(swap_delta), swap_delta.shape)
+            best_move, best_swap = move_delta[i_m, g_m], swap_delta[i_s, j_s]
+            if min(best_move, best_swap) >= -1e-9:
+                return False
+            if best_move <= best_swap:
+                self.move(i_m, g_m)
+            else:
+                ga, gb = a[i_s], a[j_s]
+                self.move(i_s, gb)
+                self.move(j_s, ga)
+            return True
+
+        # max: new largest group cost first, total change second
+        costs = self.group_costs()
+        current = costs.max()
+        others = self._others_max(costs)
+        new_from = costs[a][:, None] - own[:, None]             # group i leaves
+        new_to = costs[None, :] + self.c                         # group i joins
+        move_max = np.maximum(np.maximum(new_from, new_to), others[a[:, None], np.arange(self.k)[None, :]])
+        new_a = costs[a][:, None] - own[:, None] + cross.T - self.w   # i's group: i out, j in
+        new_b = costs[a][None, :] - own[None, :] + cross - self.w     # j's group: j out, i in
+        swap_max = np.maximum(np.maximum(new_a, new_b), others[a[:, None], a[None, :]])
+
+        candidates = []
+        for max_new, delta, ok in ((move_max, move_delta, allowed), (swap_max, swap_delta, swap_ok)):
+            score = np.where(ok, max_new, np.inf)
+            lowest = score.min()
+            pos = np.unravel_index(np.argmin(np.where(score <= lowest + 1e-9, delta, np.inf)), score.shape)
+            candidates.append((score[pos], delta[pos], pos))
+        (m_max, m_delta, m_pos), (s_max, s_delta, s_pos) = candidates
+        use_move = (m_max, m_delta) <= (s_max, s_delta)
+        new_max, delta, (i, j) = (m_max, m_delta, m_pos) if use_move else (s_max, s_delta, s_pos)
+        if not (new_max < current - 1e-9 or (new_max <= current + 1e-9 and delta < -1e-9)):
+            return False
+        if use_move:
+            self.move(i, j)
+        else:
+            ga, gb = a[i], a[j]
+            self.move(i, gb)
+            self.move(j, ga)
+        return True
+
+
+def _seed(w, k, lo, hi, rng):
+    """Assignment from k-medoids++ seeds, filled greedily under the size limits."""
+    n = len(w)
+    medoids = [int(rng.integers(n))]
+    for _ in range(1, k):
+        dist = w[:, medoids].min(axis=1)
+        weights = dist ** 2
+        total = weights.sum()
+        medoids.append(int(rng.choice(n, p=weights / total)) if total > 0 else
+                       int(rng.choice(np.setdiff1d(np.arange(n), medoids))))
+    assign = np.full(n, -1, dtype=np.intp)
+    sizes = np.zeros(k, dtype=np.intp)
+    for g, m in enumerate(medoids):
+        assign[m] = g
+        sizes[g] = 1
+    # Teams with the most to lose from a bad group pick first
+    d = w[:, medoids].astype(np.float64)
+    ranked = np.sort(d, axis=1)
+    regret = ranked[:, 1] - ranked[:, 0] if k > 1 else np.zeros(n)
+    for i in np.argsort(-regret, kind="stable"):
+        if assign[i] >= 0:
+            continue
+        remaining = int((assign < 0).sum())
+        short = np.maximum(lo - sizes, 0)
+        for g in np.argsort(d[i], kind="stable"):
+            # Keep enough teams back to bring every group up to the minimum
+            if sizes[g] < hi and short.sum() - (sizes[g] < lo) <= remaining - 1:
+                assign[i] = g
+                sizes[g] += 1
+                break
+    return assign
+
+
+def optimize_groups(store, teams, k, min_size=None, max_size=None, objective="total",
+                    time_budget=2.0, seed=0, max_starts=None):
+    """Best Grouping of teams into k groups found within time_budget seconds."""
+    if objective not in OBJECTIVES:
+        raise ValueError(f"objective must be one of {', '.join(OBJECTIVES)}")
+    teams = list(dict.fromkeys(teams))
+    unknown = [name for name in teams if name not in store.index]
+    if unknown:
+        raise ValueError(f"Unknown club: {unknown[0]}")
+    lo, hi = size_limits(len(teams), k, min_size, max_size)
+    w = pair_costs(store, teams)
+    rng = np.random.default_rng(seed)
+
+    best, best_key, starts = None, None, 0
+    deadline = time.perf_counter() + time_budget
+    while True:
+        # Descend on total first; for "max" that is a cheap start for the slower max steps
+        search = _Search(w, k, lo, hi, "total", _seed(w, k, lo, hi, rng))
+        for phase in ("total", "max") if objective == "max" else ("total",):
+            search.objective = phase
+            while time.perf_counter() < deadline and search.best_step():
+                pass
+        starts += 1
+        costs = search.group_costs()
+        key = (costs.sum(),) if objective == "total" else (costs.max(), costs.sum())
+        if best_key is None or key < best_key:
+            best, best_key = (search.assign.copy(), costs), key
+        if time.perf_counter() > deadline or (max_starts and starts >= max_starts):
+            break
+
+    assign, costs = best
+    groups = [[teams[i] for i in np.flatnonzero(assign == g)] for g in range(k)]
+    order = sorted(range(k), key=lambda g: groups[g][0] if groups[g] else "")
+    return Grouping([groups[g] for g in order], [float(costs[g]) for g in order], objective, starts)
+
+
+def read_teams(path):
+    """Team names from a .json list or a text file with one name per line."""
+    path = Path(path)
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.suffix.lower() == ".json":
+            return json.load(f)
+        return [line.strip() for line in f if line.strip()]
+
+
+def write_exports(grouping, store, clubs, export_dir):
+    """Write puljer.csv and puljer.xlsx (overview plus one matrix sheet per group)."""
+    export_dir.mkdir(exist_ok=True)
+    city = {c["name"]: c.get("city", "") for c in clubs}
+
+    def minutes(src, dst):
+        sec = float(store.durations[store.index[src], store.index[dst]])
+        return int(round(sec / 60)) if np.isfinite(sec) else None
+
+    def team_minutes(group, name):
+        times = [minutes(name, other) for other in group if other != name]
+        return sum(t for t in times if t is not None)
+
+    csv_path = export_dir / "puljer.csv"
+    with open(csv_path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["Pulje", "Klub", "By", "Kørselstid ude (min)"])
+        for g, group in enumerate(grouping.groups, 1):
+            for name in group:
+                writer.writerow([g, name, city.get(name, ""), team_minutes(group, name)])
+    print(f"Generated exports/{csv_path.name}")
+
+    wb = openpyxl.Workbook(write_only=True)
+    add_named_styles(wb)
+    ws = wb.create_sheet("Puljer")
+    styled = StyledCells(ws)
+    for col_letter, width in (("A", 10), ("B", 30), ("C", 20), ("D", 22)):
+        ws.column_dimensions[col_letter].width = width
+    ws.append([styled(h, "header_plain") for h in ["Pulje", "Klub", "By", "Kørselstid ude (min)"]])
+    for g, group in enumerate(grouping.groups, 1):
+        for name in group:
+            ws.append([styled(g, "cell_plain"), styled(name, "club_plain"),
+                       city.get(name, ""), styled(team_minutes(group, name), "cell_plain")])
+    for g, group in enumerate(grouping.groups, 1):
+        values = [[minutes(src, dst) for dst in group] for src in group]
+        write_matrix_sheet(wb, f"Pulje {g}", group, values, banded=True)
+    xlsx_path = export_dir / "puljer.xlsx"
+    wb.save(xlsx_path)
+    print(f"Generated exports/{xlsx_path.name}")
+    return [csv_path, xlsx_path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split teams into league groups with minimal driving")
+    parser.add_argument("--data-dir", default=str(BASE_DIR / "data"))
+    parser.add_argument("--export-dir", default=str(BASE_DIR / "exports"))
+    parser.add_argument("--teams", help="Teams as .json list or text file (default: all clubs)")
+    parser.add_argument("--groups", type=int, required=True, help="Number of groups")
+    parser.add_argument("--min-size", type=int)
+    parser.add_argument("--max-size", type=int)
+    parser.add_argument("--objective", choices=OBJECTIVES, default="total")
+    parser.add_argument("--time-budget", type=float, default=5.0, help="Seconds to search")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir)
+    with open(data_dir / "clubs.json", "r", encoding="utf-8") as f:
+        clubs = json.load(f)
+    store = MatrixStore.load(data_dir)
+    teams = read_teams(args.teams) if args.teams else [c["name"] for c in clubs]
+
+    try:
+        grouping = optimize_groups(store, teams, args.groups, args.min_size, args.max_size,
+                                   args.objective, args.time_budget, args.seed)
+    except ValueError as e:
+        sys.exit(f"ERROR: {e}")
+    print(grouping.summary())
+    for g, (group, cost) in enumerate(zip(grouping.groups, grouping.group_costs), 1):
+        print(f"  Pulje {g}: {len(group)} teams, {cost / 60:.0f} min")
+    write_exports(grouping, store, clubs, Path(args.export_dir))
+
+
+if __name__ == "__main__":
+    main()
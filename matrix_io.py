@@ -0,0 +1,442 @@
+"""
+Shared helpers for reading and writing the driving matrix.
+
+The matrix is kept in a MatrixStore (matrix_store.py). save_matrix() saves
+the store and exports it as matrix.json (a dict keyed by "A|B") and as a
+compact format for the browser:
+
+    data/matrix_index.json  club names (row/column order), array layout and
+                            the matrix "revision" (see the deltas below)
+    data/matrix.bin         row-major little-endian arrays:
+                            Uint16 seconds (N*N), then Uint32 decametres (N*N)
+
+Seconds are stored whole, chosen by whole_seconds() so that the browser's
+rule (minutes = seconds / 60 rounded half up, text from floored minutes,
+see compact_entry() and makeEntry() in index.html) gives the same
+duration_min and duration_text as matrix.json; matrix.json's duration_sec
+is the same whole value. save_matrix() checks that every cell decodes to
+its matrix.json entry.
+
+Cells without a route hold MISSING_SEC / MISSING_DAM, and cells left out
+in radius mode (see matrix_update.py) hold NOT_COMPUTED_SEC /
+NOT_COMPUTED_DAM.
+
+It also writes one small row file per club so the browser can fetch only
+the rows a query needs:
+
+    data/rows/manifest.json  club names (column order) and club -> row file
+    data/rows/<hash>.json    outbound and inbound seconds/decametres for
+                             one club, null where there is no route and
+                             -1 where it was not computed, plus
+                             "rank" (column indices of the other clubs,
+                             closest first) and "bands" (how many of them
+                             are within each of the manifest's "bands"
+                             minute limits), so nearest-k and radius
+                             lookups are slices of "rank"
+
+Row filenames are a hash of the row content, so unchanged rows keep their
+name (and browser cache) across builds.
+
+Each save also writes a delta from the previous compact matrix, so a
+browser that keeps the matrix (index.html stores it in IndexedDB) only
+downloads the cells that changed:
+
+    data/deltas/index.json   current "revision" (a hash of the club list
+                             and matrix.bin), "full_bytes" (matrix.bin
+                             size) and the chain of the last MAX_DELTAS
+                             deltas as {"from", "to", "file", "bytes",
+                             "cells"}
+    data/deltas/<from>-<to>.json
+                             new club order, added and removed clubs and
+                             the changed cells as flat indices
+                             (row * N + column in the new order) with their
+                             compact values; every cell of an added club
+                             is included
+
+A delta larger than matrix.bin is not worth downloading, so it ends the
+chain instead and clients fall back to the full matrix.
+
+Club coordinates used for routing are kept in data/coords.json
+({name: [lat, lon]}) so later passes such as repair_matrix.py can route
+without geocoding again.
+"""
+import array
+import hashlib
+import json
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+
+COMPACT_VERSION = 1
+MISSING_SEC = 0xFFFF
+MISSING_DAM = 0xFFFFFFFF
+NOT_COMPUTED_SEC = 0xFFFE
+NOT_COMPUTED_DAM = 0xFFFFFFFE
+ROW_NOT_COMPUTED = -1
+# Colour bands of generate_exports.py and index.html (minutes, inclusive)
+BAND_MINUTES = (15, 30, 45)
+DELTA_DIR = "deltas"
+MAX_DELTAS = 20
+
+
+def format_duration(duration_sec):
+    """Format seconds as "X min" or "H t M min" (same text as index.html)."""
+    mins = int(duration_sec // 60)
+    if mins >= 60:
+        return f"{mins // 60} t {mins % 60} min"
+    return f"{mins} min"
+
+
+def whole_seconds(duration_sec):
+    """Whole seconds closest to duration_sec that give back its minutes and text.
+
+    duration_min is round(duration_sec / 60) and duration_text uses the
+    floored minutes; plain rounding of the seconds can change either near
+    a half or whole minute (119.7 s is "1 min", 120 s is "2 min"). The
+    result is within one second of duration_sec, and rounding it to
+    minutes half up (compact_entry(), index.html) gives duration_min.
+    """
+    floored = math.floor(duration_sec / 60)
+    low = floored * 60 + (30 if round(duration_sec / 60) > floored else 0)
+    return min(max(round(duration_sec), low), low + 29)
+
+
+def whole_seconds_array(durations):
+    """whole_seconds() of every finite value of an array (float64 result)."""
+    durations = np.asarray(durations, dtype=np.float64)
+    floored = np.floor(durations / 60)
+    low = floored * 60 + np.where(np.rint(durations / 60) > floored, 30, 0)
+    return np.clip(np.rint(durations), low, low + 29)
+
+
+def make_entry(duration_sec, distance_m):
+    """Build a matrix.json entry from OSRM duration (s) and distance (m)."""
+    return {
+        "duration_min": round(duration_sec / 60),
+        "duration_sec": whole_seconds(duration_sec),
+        "distance_km": round(distance_m / 1000, 1),
+        "duration_text": format_duration(duration_sec)
+    }
+
+
+def compact_entry(sec, dam):
+    """matrix.json entry of a compact cell, computed like makeEntry() in index.html."""
+    return {
+        "duration_min": (sec + 30) // 60,
+        "duration_sec": sec,
+        "distance_km": round(dam / 100, 1),
+        "duration_text": format_duration(sec)
+    }
+
+
+def encode_compact(store):
+    """Encode a MatrixStore into (index, payload bytes)."""
+    durations = store.durations.astype(np.float64)
+    missing = np.isnan(durations)
+    skipped = np.isposinf(durations)
+    routed = ~(missing | skipped)
+    # Same values as matrix.json; clamp so real values never collide with the markers
+    secs = np.where(missing, MISSING_SEC, NOT_COMPUTED_SEC)
+    secs[routed] = np.minimum(whole_seconds_array(durations[routed]), NOT_COMPUTED_SEC - 1)
+    dams = np.where(missing, MISSING_DAM, NOT_COMPUTED_DAM)
+    km = np.round(store.distances[routed].astype(np.float64) / 1000, 1)
+    dams[routed] = np.minimum(np.rint(km * 100), NOT_COMPUTED_DAM - 1)
+
+    sec_bytes = secs.astype("<u2").tobytes()
+    padding = b"\0" * (-len(sec_bytes) % 4)  # Uint32Array needs 4-byte alignment
+    index = {
+        "version": COMPACT_VERSION,
+        "clubs": list(store.names),
+        "durations": {"offset": 0, "type": "uint16", "unit": "s", "missing": MISSING_SEC,
+                      "not_computed": NOT_COMPUTED_SEC},
+        "distances": {"offset": len(sec_bytes) + len(padding), "type": "uint32",
+                      "unit": "dam", "missing": MISSING_DAM, "not_computed": NOT_COMPUTED_DAM},
+    }
+    payload = sec_bytes + padding + dams.astype("<u4").tobytes()
+    index["revision"] = compact_revision(index, payload)
+    return index, payload
+
+
+def compact_arrays(index, payload):
+    """(seconds, decametres) of the compact format as read-only (N, N) arrays."""
+    n = len(index["clubs"])
+    secs = np.frombuffer(payload, "<u2", n * n, index["durations"]["offset"]).reshape(n, n)
+    dams = np.frombuffer(payload, "<u4", n * n, index["distances"]["offset"]).reshape(n, n)
+    return secs, dams
+
+
+def compact_revision(index, payload):
+    """Short hash identifying a compact matrix (club order and values)."""
+    digest = hashlib.sha256(json.dumps(index["clubs"], ensure_ascii=False).encode("utf-8"))
+    digest.update(payload)
+    return digest.hexdigest()[:16]
+
+
+def decode_compact(index, payload):
+    """Decode (index, payload bytes) back into a keyed matrix dict."""
+    names = index["clubs"]
+    n = len(names)
+    secs = array.array("H")
+    off = index["durations"]["offset"]
+    secs.frombytes(payload[off:off + 2 * n * n])
+    dams = array.array("I")
+    off = index["distances"]["offset"]
+    dams.frombytes(payload[off:off + 4 * n * n])
+    if sys.byteorder != "little":
+        secs.byteswap()
+        dams.byteswap()
+
+    matrix = {}
+    for i, src in enumerate(names):
+        row = i * n
+        for j, dst in enumerate(names):
+            sec = secs[row + j]
+            if sec == MISSING_SEC or sec == NOT_COMPUTED_SEC:
+                continue
+            matrix[f"{src}|{dst}"] = compact_entry(sec, dams[row + j])
+    return matrix
+
+
+def compact_mismatches(matrix, index, payload):
+    """Keys of cells where the compact format and the keyed matrix disagree (none expected)."""
+    names = index["clubs"]
+    n = len(names)
+    pos = {name: i for i, name in enumerate(names)}
+    secs, dams = (a.ravel() for a in compact_arrays(index, payload))
+    bad = []
+    for key, entry in matrix.items():
+        src, dst = key.split("|", 1)
+        cell = pos[src] * n + pos[dst]
+        if compact_entry(int(secs[cell]), int(dams[cell])) != entry:
+            bad.append(key)
+    routed = np.flatnonzero(secs < NOT_COMPUTED_SEC)
+    if len(routed) != len(matrix):
+        bad += [key for key in (f"{names[c // n]}|{names[c % n]}" for c in routed.tolist()) if key not in matrix]
+    return bad
+
+
+def write_compact(store, data_dir="data", encoded=None):
+    """Write data/matrix_index.json and data/matrix.bin (encoded: encode_compact(store) if done already)."""
+    data_dir = Path(data_dir)
+    index, payload = encoded or encode_compact(store)
+    with open(data_dir / "matrix_index.json", "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    with open(data_dir / "matrix.bin", "wb") as f:
+        f.write(payload)
+    return len(payload)
+
+
+def load_compact(data_dir="data"):
+    """(index, payload bytes) of the written compact format, or None if missing."""
+    data_dir = Path(data_dir)
+    if not (data_dir / "matrix_index.json").exists() or not (data_dir / "matrix.bin").exists():
+        return None
+    with open(data_dir / "matrix_index.json", "r", encoding="utf-8") as f:
+        index = json.load(f)
+    with open(data_dir / "matrix.bin", "rb") as f:
+        payload = f.read()
+    return index, payload
+
+
+def read_compact(data_dir="data"):
+    """Read the compact format back into (names, keyed matrix)."""
+    index, payload = load_compact(data_dir)
+    return index["clubs"], decode_compact(index, payload)
+
+
+def make_delta(old, new):
+    """Delta dict turning compact matrix old into new; both are (index, payload)."""
+    (old_index, old_payload), (new_index, new_payload) = old, new
+    old_secs, old_dams = compact_arrays(old_index, old_payload)
+    new_secs, new_dams = compact_arrays(new_index, new_payload)
+    old_pos = {name: i for i, name in enumerate(old_index["clubs"])}
+    names = new_index["clubs"]
+    src = np.array([old_pos.get(name, -1) for name in names], dtype=np.intp)
+    kept = np.flatnonzero(src >= 0)
+
+    changed = np.ones(new_secs.shape, dtype=bool)
+    old_cells = np.ix_(src[kept], src[kept])
+    new_cells = np.ix_(kept, kept)
+    changed[new_cells] = (old_secs[old_cells] != new_secs[new_cells]) | (old_dams[old_cells] != new_dams[new_cells])
+    cells = np.flatnonzero(changed)
+    new_names = set(names)
+    return {
+        "version": COMPACT_VERSION,
+        "from": compact_revision(old_index, old_payload),
+        "to": compact_revision(new_index, new_payload),
+        "clubs": list(names),
+        "added": [name for name in names if name not in old_pos],
+        "removed": [name for name in old_index["clubs"] if name not in new_names],
+        "cells": cells.tolist(),
+        "sec": new_secs.ravel()[cells].tolist(),
+        "dam": new_dams.ravel()[cells].tolist(),
+    }
+
+
+def apply_delta(old, delta):
+    """(seconds, decametres) arrays of the matrix delta leads to from old (index, payload)."""
+    old_index, old_payload = old
+    old_secs, old_dams = compact_arrays(old_index, old_payload)
+    old_pos = {name: i for i, name in enumerate(old_index["clubs"])}
+    n = len(delta["clubs"])
+    src = np.array([old_pos.get(name, -1) for name in delta["clubs"]], dtype=np.intp)
+    kept = np.flatnonzero(src >= 0)
+    secs = np.zeros((n, n), dtype="<u2")
+    dams = np.zeros((n, n), dtype="<u4")
+    secs[np.ix_(kept, kept)] = old_secs[np.ix_(src[kept], src[kept])]
+    dams[np.ix_(kept, kept)] = old_dams[np.ix_(src[kept], src[kept])]
+    secs.ravel()[delta["cells"]] = delta["sec"]
+    dams.ravel()[delta["cells"]] = delta["dam"]
+    return secs, dams
+
+
+def write_delta(previous, data_dir="data"):
+    """Add the delta from previous (index, payload) to the written matrix to data/deltas/.
+
+    Returns the delta's entry in data/deltas/index.json, or None when
+    nothing changed or the chain was restarted.
+    """
+    data_dir = Path(data_dir)
+    delta_dir = data_dir / DELTA_DIR
+    delta_dir.mkdir(exist_ok=True)
+    current = load_compact(data_dir)
+    revision = compact_revision(*current)
+    log_path = delta_dir / "index.json"
+    log = {"deltas": []}
+    if log_path.exists():
+        with open(log_path, "r", encoding="utf-8") as f:
+            log = json.load(f)
+
+    entry = None
+    deltas = []
+    if previous is not None and compact_revision(*previous) == revision:
+        deltas = log["deltas"]
+    elif previous is not None:
+        delta = make_delta(previous, current)
+        body = json.dumps(delta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if len(body) < len(current[1]):
+            # Older deltas only chain on if they end where this one starts
+            if log.get("revision") == delta["from"]:
+                deltas = log["deltas"][-(MAX_DELTAS - 1):]
+            entry = {"from": delta["from"], "to": delta["to"], "file": f"{delta['from']}-{delta['to']}.json",
+                     "bytes": len(body), "cells": len(delta["cells"]),
+                     "built": time.strftime("%Y-%m-%dT%H:%M:%S")}
+            (delta_dir / entry["file"]).write_bytes(body)
+            deltas.append(entry)
+        else:
+            print(f"  Delta would be {len(body)} bytes, more than matrix.bin; clients reload the full matrix")
+
+    with open(log_path, "w", encoding="utf-8") as f:
+        json.dump({"version": COMPACT_VERSION, "revision": revision, "full_bytes": len(current[1]),
+                   "deltas": deltas}, f, ensure_ascii=False, indent=1)
+
+    # Drop delta files that fell out of the chain
+    keep = {d["file"] for d in deltas} | {"index.json"}
+    for path in delta_dir.glob("*.json"):
+        if path.name not in keep:
+            path.unlink()
+    return entry
+
+
+def encode_rows(store):
+    """Outbound and inbound times and the ranking per club, aligned with store.names."""
+    secs, dams = compact_arrays(*encode_compact(store))
+    ranking, bands = store.ranking()
+
+    def cells(values, missing, not_computed):
+        return [None if v == missing else ROW_NOT_COMPUTED if v == not_computed else v
+                for v in values.tolist()]
+
+    for i, club in enumerate(store.names):
+        yield {"club": club,
+               "out_sec": cells(secs[i], MISSING_SEC, NOT_COMPUTED_SEC),
+               "out_dam": cells(dams[i], MISSING_DAM, NOT_COMPUTED_DAM),
+               "in_sec": cells(secs[:, i], MISSING_SEC, NOT_COMPUTED_SEC),
+               "in_dam": cells(dams[:, i], MISSING_DAM, NOT_COMPUTED_DAM),
+               "rank": [j for j in ranking[i].tolist() if j >= 0], "bands": bands[i].tolist()}
+
+
+def write_rows(store, data_dir="data"):
+    """Write data/rows/<hash>.json per club plus data/rows/manifest.json."""
+    rows_dir = Path(data_dir) / "rows"
+    rows_dir.mkdir(parents=True, exist_ok=True)
+    files = {}
+    for row in encode_rows(store):
+        body = json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        filename = hashlib.sha1(body).hexdigest()[:16] + ".json"
+        path = rows_dir / filename
+        if not path.exists():
+            path.write_bytes(body)
+        files[row["club"]] = filename
+
+    manifest = {"version": COMPACT_VERSION, "clubs": list(store.names), "rows": files,
+                "bands": list(BAND_MINUTES), "not_computed": ROW_NOT_COMPUTED}
+    with open(rows_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    # Drop row files no longer referenced by the manifest
+    keep = set(files.values()) | {"manifest.json"}
+    for path in rows_dir.glob("*.json"):
+        if path.name not in keep:
+            path.unlink()
+    return len(files)
+
+
+def save_matrix(store, data_dir="data"):
+    """Save the MatrixStore and export matrix.json, the compact format, its delta and row files.
+
+    matrix.json and the compact format are made and checked against each
+    other before anything is written, so a failed check leaves all files
+    as they were.
+    """
+    data_dir = Path(data_dir)
+    previous = load_compact(data_dir)
+    with metrics.span("save.encode"):
+        matrix = store.to_dict()
+        encoded = encode_compact(store)
+        mismatches = compact_mismatches(matrix, *encoded)
+    if mismatches:
+        raise RuntimeError(f"matrix.bin would disagree with matrix.json in {len(mismatches)} cells, "
+                           f"e.g. {', '.join(mismatches[:3])}")
+    with metrics.span("save.store"):
+        store.save(data_dir)
+    print(f"  Saved {data_dir / 'store'} ({len(store)} clubs)")
+    with metrics.span("save.matrix_json") as span:
+        with open(data_dir / "matrix.json", "w", encoding="utf-8") as f:
+            json.dump(matrix, f, ensure_ascii=False)
+        span["bytes"] = (data_dir / "matrix.json").stat().st_size
+    print(f"  Saved {data_dir / 'matrix.json'} ({len(matrix)} entries)")
+    with metrics.span("save.compact") as span:
+        size = span["bytes"] = write_compact(store, data_dir, encoded)
+    print(f"  Saved {data_dir / 'matrix.bin'} ({len(store)} clubs, {size} bytes)")
+    with metrics.span("save.delta") as span:
+        entry = write_delta(previous, data_dir)
+        span["bytes"] = entry["bytes"] if entry else 0
+    if entry:
+        print(f"  Saved {data_dir / DELTA_DIR / entry['file']} ({entry['cells']} cells, {entry['bytes']} bytes)")
+    with metrics.span("save.rows"):
+        count = write_rows(store, data_dir)
+    print(f"  Saved {data_dir / 'rows'} ({count} row files)")
+
+
+def save_coords(coords, data_dir="data"):
+    """Write data/coords.json from {name: (lat, lon)}."""
+    path = Path(data_dir) / "coords.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({name: [lat, lon] for name, (lat, lon) in sorted(coords.items())},
+                  f, ensure_ascii=False, indent=1)
+    print(f"  Saved {path} ({len(coords)} clubs)")
+
+
+def load_coords(data_dir="data"):
+    """Read data/coords.json into {name: (lat, lon)}; empty if missing."""
+    path = Path(data_dir) / "coords.json"
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return {name: tuple(latlon) for name, latlon in json.load(f).items()}
@@ -0,0 +1,267 @@
+"""
+Driving matrix held as two N x N NumPy arrays with a club name <-> index map.
+
+durations (seconds) and distances (metres) are float32, with NaN where
+there is no route and +inf where the route was deliberately not computed
+(clubs too far apart in radius mode, see matrix_update.py). Rows and columns are added, removed and reordered
+with vectorized NumPy operations instead of scanning "A|B" keys, and
+the store is persisted as .npy files that are memory-mapped on load
+(services that keep the store open load a copy instead, see save()):
+
+    data/store/names.json      club names in row/column order
+    data/store/durations.npy   float32 seconds, NaN = no route, inf = not computed
+    data/store/distances.npy   float32 metres, NaN = no route, inf = not computed
+
+It also keeps a per-club ranking, so nearest-k and "within X minutes"
+queries are slices instead of row scans:
+
+    data/store/ranking.npy     int32, row i lists the other clubs with a
+                               route from club i, closest first (padded
+                               with -1)
+    data/store/bands.npy       int32, bands[i, b] = number of those within
+                               BAND_MINUTES[b] minutes
+
+matrix.json, the compact matrix.bin and the row files are exports of the
+store (see matrix_io.save_matrix).
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from matrix_io import BAND_MINUTES, format_duration, make_entry
+
+STORE_DIR = "store"
+NOT_COMPUTED = np.inf
+
+
+def _entry_seconds(entry):
+    """Seconds reproducing all rounded fields of a matrix.json entry.
+
+    Entries only keep duration_sec rounded, but duration_min and
+    duration_text were made from the unrounded time, so pick a value
+    that gives the same minutes and text again.
+    """
+    sec = entry["duration_sec"]
+    for candidate in (sec, sec - 0.25, sec + 0.25, sec - 0.49, sec + 0.49):
+        if (round(candidate / 60) == entry["duration_min"] and
+                format_duration(candidate) == entry["duration_text"]):
+            return candidate
+    return sec
+
+
+class MatrixStore:
+    def __init__(self, names=(), durations=None, distances=None):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        n = len(self.names)
+        self.durations = np.full((n, n), np.nan, dtype=np.float32) if durations is None else durations
+        self.distances = np.full((n, n), np.nan, dtype=np.float32) if distances is None else distances
+        self._ranking = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def count(self):
+        """Number of cells with a route."""
+        return int(np.count_nonzero(np.isfinite(self.durations)))
+
+    def not_computed_count(self):
+        """Number of cells marked not computed."""
+        return int(np.count_nonzero(self.durations == NOT_COMPUTED))
+
+    def get(self, src, dst):
+        """matrix.json entry for src -> dst, or None."""
+        i, j = self.index.get(src), self.index.get(dst)
+        if i is None or j is None or not np.isfinite(self.durations[i, j]):
+            return None
+        return make_entry(float(self.durations[i, j]), float(self.distances[i, j]))
+
+    def set(self, i, j, duration_sec, distance_m):
+        self.durations[i, j] = duration_sec
+        self.distances[i, j] = distance_m
+        self._ranking = None
+
+    def fill_block(self, idx, mask, value):
+        """Set cells of the idx x idx block where mask is True to value
+        (NaN for missing, NOT_COMPUTED for not computed)."""
+        block = np.ix_(idx, idx)
+        for arr in (self.durations, self.distances):
+            sub = arr[block]
+            sub[mask] = value
+            arr[block] = sub
+        self._ranking = None
+
+    def add_clubs(self, names):
+        """Append clubs not in the store yet, with empty rows and columns."""
+        new = [name for name in dict.fromkeys(names) if name not in self.index]
+        if new:
+            k = len(new)
+            pad = ((0, k), (0, k))
+            self.durations = np.pad(self.durations, pad, constant_values=np.nan)
+            self.distances = np.pad(self.distances, pad, constant_values=np.nan)
+            for name in new:
+                self.index[name] = len(self.names)
+                self.names.append(name)
+            self._ranking = None
+        return new
+
+    def remove_clubs(self, names):
+        """Drop the rows and columns of clubs (exact name match)."""
+        drop = [self.index[name] for name in set(names) if name in self.index]
+        if drop:
+            keep = np.setdiff1d(np.arange(len(self.names)), drop)
+            self._take(keep)
+        return len(drop)
+
+    def clear_clubs(self, names):
+        """Mark every route from or to clubs as missing (including not computed ones)."""
+        idx = [self.index[name] for name in names if name in self.index]
+        for arr in (self.durations, self.distances):
+            arr[idx, :] = np.nan
+            arr[:, idx] = np.nan
+        self._ranking = None
+
+    def reorder(self, names):
+        """Rows and columns in the order of names; unknown clubs are added empty."""
+        self.add_clubs(names)
+        self.remove_clubs(set(self.names) - set(names))
+        self._take(np.array([self.index[name] for name in names], dtype=np.intp))
+
+    def _take(self, idx):
+        # Fancy indexing copies, which also detaches a memory-mapped store
+        self.durations = self.durations[np.ix_(idx, idx)]
+        self.distances = self.distances[np.ix_(idx, idx)]
+        self.names = [self.names[i] for i in idx]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self._ranking = None
+
+    def missing_cells(self, rows=None, cols=None):
+        """(i, j) store indices without a route, within rows x cols if given.
+
+        Cells marked not computed are not missing.
+        """
+        rows = np.arange(len(self.names)) if rows is None else np.asarray(rows, dtype=np.intp)
+        cols = np.arange(len(self.names)) if cols is None else np.asarray(cols, dtype=np.intp)
+        sub_i, sub_j = np.nonzero(np.isnan(self.durations[np.ix_(rows, cols)]))
+        return list(zip(rows[sub_i].tolist(), cols[sub_j].tolist()))
+
+    def ranking(self):
+        """(ranking, bands) arrays as described in the module docstring."""
+        if self._ranking is None:
+            n = len(self.names)
+            durations = np.array(self.durations, dtype=np.float64)
+            np.fill_diagonal(durations, np.nan)
+            order = np.argsort(durations, axis=1, kind="stable").astype(np.int32)  # inf, NaN sort last
+            counts = np.count_nonzero(np.isfinite(durations), axis=1)
+            order[np.arange(n)[None, :] >= counts[:, None]] = -1
+            minutes = np.rint(durations / 60)
+            bands = np.stack([np.count_nonzero(minutes <= limit, axis=1) for limit in BAND_MINUTES], axis=1)
+            self._ranking = order, bands.astype(np.int32)
+        return self._ranking
+
+    def nearest(self, name, k=10):
+        """Up to k (club, seconds) pairs closest to name, closest first."""
+        i = self.index[name]
+        ranking, _ = self.ranking()
+        row = ranking[i, :k]
+        row = row[row >= 0].tolist()
+        return [(self.names[j], float(self.durations[i, j])) for j in row]
+
+    def within(self, name, minutes):
+        """(club, seconds) pairs reachable from name within minutes, closest first.
+
+        Minutes are rounded like duration_min; the band limits are a
+        precomputed slice, other limits a binary search on the ranking.
+        """
+        i = self.index[name]
+        ranking, bands = self.ranking()
+        if minutes in BAND_MINUTES:
+            end = int(bands[i, BAND_MINUTES.index(minutes)])
+        else:
+            row = ranking[i][ranking[i] >= 0]
+            end = int(np.searchsorted(np.rint(self.durations[i, row].astype(np.float64) / 60), minutes, "right"))
+        return [(self.names[j], float(self.durations[i, j])) for j in ranking[i, :end].tolist()]
+
+    @classmethod
+    def from_dict(cls, matrix, names=None):
+        """Store from a keyed matrix.json dict; names default to the clubs in it."""
+        if names is None:
+            names = dict.fromkeys(part for key in matrix for part in key.split("|", 1))
+        store = cls(names)
+        for key, entry in matrix.items():
+            src, dst = key.split("|", 1)
+            i, j = store.index.get(src), store.index.get(dst)
+            if i is not None and j is not None:
+                store.set(i, j, _entry_seconds(entry), entry["distance_km"] * 1000)
+        return store
+
+    def to_dict(self):
+        """Keyed matrix.json dict."""
+        matrix = {}
+        rows, cols = np.nonzero(np.isfinite(self.durations))
+        secs = self.durations[rows, cols].tolist()
+        metres = self.distances[rows, cols].tolist()
+        for i, j, sec, m in zip(rows.tolist(), cols.tolist(), secs, metres):
+            matrix[f"{self.names[i]}|{self.names[j]}"] = make_entry(sec, m)
+        return matrix
+
+    def save(self, data_dir="data"):
+        store_dir = Path(data_dir) / STORE_DIR
+        store_dir.mkdir(parents=True, exist_ok=True)
+        # Write next to the old files and swap them in, so other processes
+        # reading the store never see half a file. Windows cannot replace a
+        # file that is memory-mapped, so this store lets go of its own
+        # mappings first and long-running readers (query_server.py) load
+        # copies with mmap=False.
+        self._detach()
+        ranking, bands = self.ranking()
+        arrays = {"durations.npy": self.durations.astype(np.float32), "distances.npy": self.distances.astype(np.float32),
+                  "ranking.npy": ranking, "bands.npy": bands}
+        for name, arr in arrays.items():
+            tmp = store_dir / (name + ".tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(tmp, store_dir / name)
+        # Names go last: readers that see the new names also get the new arrays
+        tmp = store_dir / "names.json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.names, f, ensure_ascii=False)
+        os.replace(tmp, store_dir / "names.json")
+
+    def _detach(self):
+        """Copy arrays memory-mapped from the store files into memory."""
+        if isinstance(self.durations, np.memmap):
+            self.durations = np.array(self.durations)
+        if isinstance(self.distances, np.memmap):
+            self.distances = np.array(self.distances)
+        if self._ranking is not None and any(isinstance(arr, np.memmap) for arr in self._ranking):
+            self._ranking = tuple(np.array(arr) for arr in self._ranking)
+
+    @classmethod
+    def load(cls, data_dir="data", mmap=True):
+        """Load data/store/, memory-mapped copy-on-write unless mmap is False.
+
+        Falls back to importing data/matrix.json when there is no store
+        yet, and returns an empty store when neither exists.
+        """
+        data_dir = Path(data_dir)
+        store_dir = data_dir / STORE_DIR
+        if (store_dir / "names.json").exists():
+            with open(store_dir / "names.json", "r", encoding="utf-8") as f:
+                names = json.load(f)
+            mode = "c" if mmap else None
+            store = cls(names, np.load(store_dir / "durations.npy", mmap_mode=mode),
+                        np.load(store_dir / "distances.npy", mmap_mode=mode))
+            if (store_dir / "ranking.npy").exists() and (store_dir / "bands.npy").exists():
+                store._ranking = (np.load(store_dir / "ranking.npy", mmap_mode=mode),
+                                  np.load(store_dir / "bands.npy", mmap_mode=mode))
+            return store
+        if (data_dir / "matrix.json").exists():
+            with open(data_dir / "matrix.json", "r", encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+        return cls()
@@ -0,0 +1,112 @@
+"""
+Recompute the parts of the driving matrix affected by changed clubs.
+
+Shared by fast_update.py, full_update.py and build.py: rows and columns
+of changed clubs are routed through the TileScheduler (with route cache
+and resume journal), cells missing between unchanged clubs are filled,
+and every other cell is left as it is.
+
+Setting MATRIX_RADIUS_KM limits routing to pairs of clubs within that
+straight-line distance (found with a grid, see spatial.py); all other
+cells are marked "not computed" in the store instead of being routed.
+"""
+import os
+
+import numpy as np
+
+from journal import TileJournal
+from matrix_store import NOT_COMPUTED
+from route_cache import RouteCache
+from routing import backend_from_env
+from spatial import pairs_within
+from tiling import tile_scheduler_from_env
+
+
+def radius_from_env():
+    """MATRIX_RADIUS_KM in metres, or None for a full matrix."""
+    km = float(os.environ.get("MATRIX_RADIUS_KM", "0"))
+    return km * 1000 if km > 0 else None
+
+
+def update_matrix(store, coords, changed):
+    """Update the MatrixStore in place for clubs named in changed.
+
+    Old routes of changed clubs are cleared first; only clubs with
+    coords are routed, and in radius mode only pairs within the radius.
+    Returns (new_routes, errors, failed_tiles).
+    Finished tiles stay in the journal when some tiles failed, so a
+    rerun fetches only those.
+    """
+    store.clear_clubs(changed)
+    routed = [name for name in store.names if name in coords]
+    for name in sorted(set(changed) - set(routed)):
+        print(f"  Skipping {name} (no coordinates)")
+    points = [coords[name] for name in routed]
+    store_idx = [store.index[name] for name in routed]
+    changed_idx = [i for i, name in enumerate(routed) if name in changed]
+    unchanged_idx = [i for i, name in enumerate(routed) if name not in changed]
+    radius_m = radius_from_env()
+    block = store.durations[np.ix_(store_idx, store_idx)]
+    near_cells = []
+    if radius_m and routed:
+        # Pairs touching a changed club are routed if near and marked not
+        # computed otherwise. Between unchanged clubs, undecided cells get
+        # the same treatment and not computed cells now in range are
+        # reopened, so changing the radius only routes the difference
+        near = np.eye(len(routed), dtype=bool)
+        pairs = np.array(pairs_within(points, radius_m), dtype=np.intp).reshape(-1, 2)
+        near[pairs[:, 0], pairs[:, 1]] = near[pairs[:, 1], pairs[:, 0]] = True
+        is_changed = np.zeros(len(routed), dtype=bool)
+        is_changed[changed_idx] = True
+        touched = is_changed[:, None] | is_changed[None, :]
+        skipped = block == NOT_COMPUTED
+        store.fill_block(store_idx, (touched | np.isnan(block) | skipped) & ~near, NOT_COMPUTED)
+        store.fill_block(store_idx, skipped & near, np.nan)
+        near_cells = list(zip(*(a.tolist() for a in np.nonzero(near & touched))))
+        print(f"  Radius {radius_m / 1000:g} km: {len(pairs)} club pairs within range")
+    elif routed:
+        # Full matrix: cells left out by an earlier radius run are missing now
+        store.fill_block(store_idx, block == NOT_COMPUTED, np.nan)
+    routed_pos = {s: i for i, s in enumerate(store_idx)}
+    missing = [(routed_pos[i], routed_pos[j]) for i, j in
+               store.missing_cells([store_idx[k] for k in unchanged_idx], [store_idx[k] for k in unchanged_idx])]
+
+    backend = backend_from_env()
+    scheduler = tile_scheduler_from_env(backend)
+    print(f"  Backend: {backend.base_url} ({backend.profile})")
+    print(f"  {len(changed_idx)} changed clubs, {len(missing)} missing cells between unchanged clubs")
+
+    new_routes = 0
+    errors = 0
+
+    def store_cell(src_idx, dst_idx, dur_sec, dist_m):
+        nonlocal new_routes, errors
+        if dur_sec is None or dist_m is None:
+            errors += 1
+            return
+        store.set(store_idx[src_idx], store_idx[dst_idx], dur_sec, dist_m)
+        new_routes += 1
+
+    journal = TileJournal()
+    route_cache = RouteCache()
+    failed_tiles = []
+    if near_cells:
+        failed_tiles += scheduler.compute(points, store_cell, cells=near_cells, cache=route_cache, journal=journal)
+    elif changed_idx and not radius_m:
+        # Changed clubs -> all clubs, then unchanged clubs -> changed clubs
+        failed_tiles += scheduler.compute(points, store_cell, sources=changed_idx,
+                                          cache=route_cache, journal=journal)
+        failed_tiles += scheduler.compute(points, store_cell, sources=unchanged_idx, destinations=changed_idx,
+                                          cache=route_cache, journal=journal)
+    if missing:
+        failed_tiles += scheduler.compute(points, store_cell, cells=missing, cache=route_cache, journal=journal)
+    route_cache.close()
+
+    for tile in failed_tiles:
+        errors += len(tile.sources) * len(tile.destinations)
+    if failed_tiles:
+        print(f"  WARNING: {len(failed_tiles)} requests failed! Rerun to fetch only the missing tiles "
+              f"({len(journal)} finished tiles are kept in {journal.path})")
+    else:
+        journal.clear()
+    return new_routes, errors, failed_tiles
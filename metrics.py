@@ -0,0 +1,216 @@
+"""
+Timing and metrics for the pipeline scripts.
+
+A script starts a RunReport and marks its stages; library code records
+per-request spans and counters into the active report through the
+module-level span(), record() and count(), which do nothing when no
+report is active:
+
+    report = metrics.start_report("fast_update")
+    report.stage("geocode")
+    ...
+    report.stage("matrix")
+
+Stages run until the next stage() or finish(). The report is written when
+the script exits (also after sys.exit) to data/reports/<script>-<time>.json
+with, per stage, wall and CPU seconds, and per request kind ("osrm.table",
+"geocode.search", "save.matrix_json", ...) the count, total, p50, p95
+and max seconds plus summed values such as bytes. Counters hold retries
+and time spent waiting on rate limits and backoff.
+
+PROFILE_STAGES=matrix,exports (or "all") runs those stages under cProfile;
+the stats are saved next to the report as .prof files (for snakeviz or
+pstats) and the slowest functions are listed in the report.
+
+Compare the two latest reports of a script to spot regressions:
+    python metrics.py fast_update
+"""
+import argparse
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+REPORT_DIR = "reports"
+PROFILE_TOP = 15
+
+_active = None
+
+
+class RunReport:
+    def __init__(self, script, data_dir="data", profile_stages=None):
+        self.script = script
+        self.report_dir = Path(data_dir) / REPORT_DIR
+        self.started = datetime.now(timezone.utc)
+        self.stamp = self.started.strftime("%Y%m%d-%H%M%S")
+        if profile_stages is None:
+            profile_stages = [s.strip() for s in os.environ.get("PROFILE_STAGES", "").split(",") if s.strip()]
+        self.profile_stages = set(profile_stages)
+        self.stages = []
+        self.requests = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self._stage = None
+        self._clock = time.perf_counter()
+        self.saved = None
+
+    def stage(self, name):
+        """End the current stage (if any) and start the stage name."""
+        self.end_stage()
+        profiler = None
+        if name in self.profile_stages or "all" in self.profile_stages:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        self._stage = (name, time.perf_counter(), time.process_time(), profiler)
+
+    def end_stage(self):
+        """End the current stage, if any."""
+        if self._stage is None:
+            return
+        name, wall, cpu, profiler = self._stage
+        self._stage = None
+        entry = {"name": name, "seconds": round(time.perf_counter() - wall, 4),
+                 "cpu_seconds": round(time.process_time() - cpu, 4)}
+        if profiler is not None:
+            profiler.disable()
+            self.report_dir.mkdir(parents=True, exist_ok=True)
+            path = self.report_dir / f"{self.script}-{self.stamp}-{name}.prof"
+            profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            entry["profile"] = {"path": path.name, "top": [line for line in out.getvalue().splitlines()
+                                                           if line.strip()][-PROFILE_TOP - 1:]}
+        self.stages.append(entry)
+
+    def record(self, kind, seconds, **values):
+        with self.lock:
+            stats = self.requests.setdefault(kind, {"times": [], "values": {}})
+            stats["times"].append(seconds)
+            for key, value in values.items():
+                stats["values"][key] = stats["values"].get(key, 0) + value
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        def summary(stats):
+            times = sorted(stats["times"])
+
+            def pick(q):
+                return times[min(len(times) - 1, int(q * len(times)))]
+
+            return {"count": len(times), "total_s": round(sum(times), 4), "p50_s": round(pick(0.5), 5),
+                    "p95_s": round(pick(0.95), 5), "max_s": round(times[-1], 5),
+                    **{k: round(v, 4) for k, v in stats["values"].items()}}
+
+        with self.lock:
+            return {
+                "script": self.script,
+                "argv": sys.argv[1:],
+                "started": self.started.isoformat(timespec="seconds"),
+                "seconds": round(time.perf_counter() - self._clock, 4),
+                "stages": list(self.stages),
+                "requests": {kind: summary(stats) for kind, stats in sorted(self.requests.items())},
+                "counters": {k: round(v, 4) for k, v in sorted(self.counters.items())},
+            }
+
+    def finish(self):
+        """End the last stage and write the report; returns its path."""
+        global _active
+        if self.saved:
+            return self.saved
+        self.end_stage()
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        path = self.report_dir / f"{self.script}-{self.stamp}.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1)
+        self.saved = path
+        if _active is self:
+            _active = None
+        print(f"  Run report: {path}")
+        return path
+
+
+def start_report(script, data_dir="data", profile_stages=None):
+    """Make a RunReport the active one; it is written at exit if not finished before."""
+    global _active
+    _active = RunReport(script, data_dir, profile_stages)
+    atexit.register(_active.finish)
+    return _active
+
+
+def record(kind, seconds, **values):
+    if _active is not None:
+        _active.record(kind, seconds, **values)
+
+
+def count(name, n=1):
+    if _active is not None:
+        _active.count(name, n)
+
+
+@contextmanager
+def span(kind, **values):
+    """Time a block as one request of kind; extra values can be added to the yielded dict."""
+    values = dict(values)
+    started = time.perf_counter()
+    try:
+        yield values
+    finally:
+        record(kind, time.perf_counter() - started, **values)
+
+
+def load_reports(data_dir, script):
+    paths = sorted((Path(data_dir) / REPORT_DIR).glob(f"{script}-*.json"))
+    paths = [p for p in paths if p.stem[len(script) + 1:].replace("-", "").isdigit()]
+    reports = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            reports.append((path, json.load(f)))
+    return reports
+
+
+def compare(old, new):
+    """Print stage times and request p50/totals of two reports side by side."""
+    def change(a, b):
+        return f"{(b - a) / a * 100:+6.1f}%" if a else "     -"
+
+    print(f"{'':<28} {'previous':>10} {'latest':>10}")
+    print(f"{'total (s)':<28} {old['seconds']:>10.2f} {new['seconds']:>10.2f} {change(old['seconds'], new['seconds'])}")
+    old_stages = {s["name"]: s for s in old["stages"]}
+    for stage in new["stages"]:
+        before = old_stages.get(stage["name"], {}).get("seconds", 0)
+        print(f"{'stage ' + stage['name']:<28} {before:>10.2f} {stage['seconds']:>10.2f} "
+              f"{change(before, stage['seconds'])}")
+    for kind, stats in new["requests"].items():
+        before = old["requests"].get(kind, {})
+        print(f"{kind + ' p50 (ms)':<28} {before.get('p50_s', 0) * 1000:>10.2f} {stats['p50_s'] * 1000:>10.2f} "
+              f"{change(before.get('p50_s', 0), stats['p50_s'])}")
+        print(f"{kind + ' count':<28} {before.get('count', 0):>10} {stats['count']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the two latest run reports of a script")
+    parser.add_argument("script", help="fast_update, full_update, build, generate_exports or repair_matrix")
+    parser.add_argument("--data-dir", default=str(Path(__file__).parent / "data"))
+    args = parser.parse_args()
+
+    reports = load_reports(args.data_dir, args.script)
+    if len(reports) < 2:
+        sys.exit(f"Need two reports for {args.script} in {Path(args.data_dir) / REPORT_DIR}, found {len(reports)}")
+    (old_path, old), (new_path, new) = reports[-2:]
+    print(f"{old_path.name} -> {new_path.name}\n")
+    compare(old, new)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Local OSRM-compatible stand-in server for offline runs and load tests.
+
+Answers /table/v1/<profile>/... and /route/v1/<profile>/... from the
+straight-line (haversine) distance times a detour factor, at a fixed
+average speed. Latency, errors and null cells can be injected, and
+results are deterministic for a given --seed.
+
+Usage:
+    python osrm_stub.py --port 5000
+    python osrm_stub.py --port 5000 --latency 0.3 --error-rate 0.1 --seed 1
+
+Then point the update scripts at it:
+    OSRM_URL=http://127.0.0.1:5000 python fast_update.py
+
+GET /stats returns request counters as JSON. StubBackend answers the
+same tables in-process for benchmarks that should not measure HTTP.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from routing import OSRMBackend, haversine_m
+
+# Accept the requests the tile scheduler makes by default (tiling.py reads the same variable)
+DEFAULT_MAX_TABLE_SIZE = int(os.environ.get("OSRM_MAX_COORDS", "200"))
+
+
+class StubConfig:
+    def __init__(self, speed_kmh=60.0, detour=1.3, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=503, null_rate=0.0,
+                 max_table_size=DEFAULT_MAX_TABLE_SIZE, seed=0):
+        self.speed_kmh = speed_kmh
+        self.detour = detour
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.null_rate = null_rate
+        self.max_table_size = max_table_size
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"table": 0, "route": 0, "errors": 0, "cells": 0, "bytes": 0}
+
+    def leg(self, a, b):
+        """(duration s, distance m) for one leg."""
+        dist = haversine_m(a, b) * self.detour
+        return round(dist / (self.speed_kmh / 3.6), 1), round(dist, 1)
+
+    def is_null(self, a, b):
+        # Deterministic per coordinate pair so retries return the same cell
+        if not self.null_rate or a == b:
+            return False
+        return random.Random(f"{a}{b}").random() < self.null_rate
+
+
+class StubBackend(OSRMBackend):
+    """In-process backend giving the same answers as the server, without HTTP.
+
+    For benchmarks of everything around routing (see bench_pipeline.py);
+    latency and error injection are not applied.
+    """
+
+    def __init__(self, config=None):
+        super().__init__(base_url="stub://local", profile="driving")
+        self.config = config or StubConfig()
+
+    def table(self, points, sources=None, destinations=None):
+        cfg = self.config
+        coords = np.radians(np.asarray(points, dtype=np.float64))
+        src = coords[sources if sources is not None else slice(None)]
+        dst = coords[destinations if destinations is not None else slice(None)]
+        lat1, lon1 = src[:, 0:1], src[:, 1:2]
+        lat2, lon2 = dst[:, 0], dst[:, 1]
+        h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        dist = 2 * 6371000 * np.arcsin(np.sqrt(h)) * cfg.detour
+        return np.round(dist / (cfg.speed_kmh / 3.6), 1).tolist(), np.round(dist, 1).tolist()
+
+
+def parse_coords(text):
+    points = []
+    for pair in text.split(";"):
+        lon, lat = pair.split(",")
+        points.append((float(lat), float(lon)))
+    return points
+
+
+def parse_indices(value, count):
+    if not value or value == "all":
+        return list(range(count))
+    return [int(i) for i in value.split(";")]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config = None  # set by make_server()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        with self.config.lock:
+            self.config.stats["bytes"] += len(payload)
+
+    def do_GET(self):
+        cfg = self.config
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if parts == ["stats"]:
+            with cfg.lock:
+                return self.send_json(200, dict(cfg.stats))
+
+        if len(parts) != 4 or parts[0] not in ("table", "route") or parts[1] != "v1":
+            return self.send_json(400, {"code": "InvalidUrl", "message": "URL string malformed"})
+
+        service = parts[0]
+        with cfg.lock:
+            cfg.stats[service] += 1
+            delay = max(0.0, cfg.latency + cfg.rng.uniform(-cfg.jitter, cfg.jitter))
+            fail = cfg.rng.random() < cfg.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            with cfg.lock:
+                cfg.stats["errors"] += 1
+            return self.send_json(cfg.error_status, {"code": "Error", "message": "Injected error"})
+
+        try:
+            points = parse_coords(urllib.parse.unquote(parts[3]))
+        except ValueError:
+            return self.send_json(400, {"code": "InvalidQuery", "message": "Query string malformed"})
+        query = urllib.parse.parse_qs(url.query)
+
+        if service == "route":
+            if len(points) < 2:
+                return self.send_json(400, {"code": "InvalidQuery", "message": "Need 2 coordinates"})
+            duration = distance = 0.0
+            for a, b in zip(points, points[1:]):
+                d, m = cfg.leg(a, b)
+                duration += d
+                distance += m
+            return self.send_json(200, {"code": "Ok", "routes": [
+                {"duration": round(duration, 1), "distance": round(distance, 1)}]})
+
+        if len(points) > cfg.max_table_size:
+            return self.send_json(400, {"code": "TooBig", "message": "Too many table coordinates"})
+        try:
+            sources = parse_indices(query.get("sources", [""])[0], len(points))
+            destinations = parse_indices(query.get("destinations", [""])[0], len(points))
+            src_points = [points[i] for i in sources]
+            dst_points = [points[i] for i in destinations]
+        except (ValueError, IndexError):
+            return self.send_json(400, {"code": "InvalidQuery", "message": "Query string malformed"})
+
+        durations, distances = [], []
+        for a in src_points:
+            dur_row, dist_row = [], []
+            for b in dst_points:
+                if cfg.is_null(a, b):
+                    dur_row.append(None)
+                    dist_row.append(None)
+                    continue
+                d, m = cfg.leg(a, b)
+                dur_row.append(d)
+                dist_row.append(m)
+            durations.append(dur_row)
+            distances.append(dist_row)
+        with cfg.lock:
+            cfg.stats["cells"] += len(src_points) * len(dst_points)
+        return self.send_json(200, {"code": "Ok", "durations": durations, "distances": distances})
+
+
+def make_server(host="127.0.0.1", port=5000, **config):
+    """Create (but do not start) a stub server; port 0 picks a free port."""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": StubConfig(**config)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OSRM-compatible stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--speed-kmh", type=float, default=60.0, help="Average driving speed")
+    parser.add_argument("--detour", type=float, default=1.3, help="Road distance / straight-line distance")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status for injected errors")
+    parser.add_argument("--null-rate", type=float, default=0.0, help="Fraction of table cells returned as null")
+    parser.add_argument("--max-table-size", type=int, default=DEFAULT_MAX_TABLE_SIZE,
+                        help="Max coordinates per table request (default: OSRM_MAX_COORDS or 200)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, speed_kmh=args.speed_kmh, detour=args.detour,
+                         latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                         error_status=args.error_status, null_rate=args.null_rate,
+                         max_table_size=args.max_table_size, seed=args.seed)
+    print(f"OSRM stub listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
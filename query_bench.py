@@ -0,0 +1,126 @@
+"""
+Throughput benchmark for query_server.py.
+
+Starts the query service in-process on a free port and fires requests
+from several client threads over keep-alive connections, once with the
+LRU response cache disabled and once with it enabled (clients repeat a
+small working set, like a tool looking up the same fixtures). Reports
+requests per second and p50/p95 latency per query kind, plus the rate
+of 304 answers for conditional requests.
+
+Usage:
+    python query_bench.py
+    python query_bench.py --requests 5000 --clients 8
+"""
+import argparse
+import http.client
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+from query_server import make_server
+
+
+def make_queries(names, kind, count, rng):
+    def q(path, params):
+        return f"{path}?{urllib.parse.urlencode(params, doseq=True)}"
+
+    if kind == "pair":
+        return [q("/pair", {"from": rng.choice(names), "to": rng.choice(names)}) for _ in range(count)]
+    if kind == "row":
+        return [q("/row", {"club": rng.choice(names)}) for _ in range(count)]
+    if kind == "nearest":
+        return [q("/nearest", {"club": rng.choice(names), "k": 10}) for _ in range(count)]
+    if kind == "batch":
+        size = min(20, len(names))
+        return [q("/batch", {"from": rng.sample(names, size), "to": rng.sample(names, size)})
+                for _ in range(count)]
+    raise ValueError(kind)
+
+
+def run_clients(port, queries, clients, conditional=False):
+    """(elapsed seconds, latencies, statuses) for GETting every query once."""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    chunks = [queries[i::clients] for i in range(clients)]
+
+    def client(chunk):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        etags = {}
+        local, seen = [], {}
+        for path in chunk:
+            headers = {"If-None-Match": etags[path]} if conditional and path in etags else {}
+            started = time.perf_counter()
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            local.append(time.perf_counter() - started)
+            seen[resp.status] = seen.get(resp.status, 0) + 1
+            if resp.getheader("ETag"):
+                etags[path] = resp.getheader("ETag")
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            for status, n in seen.items():
+                statuses[status] = statuses.get(status, 0) + n
+
+    threads = [threading.Thread(target=client, args=(chunk,)) for chunk in chunks]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started, latencies, statuses
+
+
+def report(label, elapsed, latencies, statuses):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    codes = ", ".join(f"{k}: {v}" for k, v in sorted(statuses.items()))
+    print(f"  {label:<22} {len(latencies) / elapsed:>8.0f} req/s   p50 {p50:6.2f} ms   p95 {p95:6.2f} ms   ({codes})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the matrix query service")
+    parser.add_argument("--data-dir", default=str(Path(__file__).parent / "data"))
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per scenario")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent client connections")
+    parser.add_argument("--working-set", type=int, default=200, help="Distinct queries in cached runs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for cache_size in (0, 10_000):
+        server = make_server(args.data_dir, port=0, cache_size=cache_size)
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        names = server.RequestHandlerClass.service.queries.store.names
+        print(f"\nLRU cache {'off' if not cache_size else 'on'} ({args.clients} clients)")
+        for kind in ("pair", "row", "nearest", "batch"):
+            if cache_size:
+                working = make_queries(names, kind, args.working_set, rng)
+                queries = [rng.choice(working) for _ in range(args.requests)]
+            else:
+                queries = make_queries(names, kind, args.requests, rng)
+            report(kind, *run_clients(port, queries, args.clients))
+        if cache_size:
+            working = make_queries(names, "row", args.working_set, rng)
+            queries = [rng.choice(working) for _ in range(args.requests)]
+            report("row (If-None-Match)", *run_clients(port, queries, args.clients, conditional=True))
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+            conn.request("GET", "/stats")
+            stats = json.loads(conn.getresponse().read())
+            print(f"  cache hits {stats['cache_hits']}, misses {stats['cache_misses']}, "
+                  f"304s {stats['not_modified']}")
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Local HTTP query service over the driving matrix for internal tools.
+
+Loads the MatrixStore (data/store/) once and answers JSON queries:
+
+    GET  /clubs                            club names
+    GET  /pair?from=A&to=B                 one route
+    GET  /row?club=A[&direction=in]        all routes from (or to) a club
+    GET  /nearest?club=A&k=10[&direction=in]
+                                           the k clubs closest in driving time
+    GET  /within?club=A&minutes=30         clubs reachable within a time
+    GET  /batch?from=A&from=B&to=C&to=D    many-to-many (repeat the params)
+    POST /batch  {"from": [...], "to": [...]}
+    GET  /stats                            request and cache counters
+
+Routes use the matrix.json fields (duration_min, duration_sec,
+distance_km, duration_text); batch answers are rows of seconds and km
+with null where there is no route. In a radius-limited matrix (see
+matrix_update.py) /pair reports "not_computed": true for clubs too far
+apart to be routed. Responses to GET queries are kept in
+an LRU cache and carry an ETag made from the matrix version and the
+query, so clients sending If-None-Match get 304 Not Modified. The store
+is loaded into memory rather than memory-mapped, so updates can replace
+data/store/ while the server runs (Windows refuses to replace a mapped
+file), and is reloaded when data/store/ changes.
+
+Usage:
+    python query_server.py --port 8765
+    curl "http://127.0.0.1:8765/nearest?club=Aarslev%20BK&k=5"
+
+See query_bench.py for a throughput benchmark.
+"""
+import argparse
+import hashlib
+import json
+import math
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+from matrix_io import make_entry, whole_seconds_array
+from matrix_store import NOT_COMPUTED, STORE_DIR, MatrixStore
+
+RELOAD_CHECK_SECONDS = 2.0
+
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LRUCache:
+    def __init__(self, max_entries=10_000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class MatrixQueries:
+    """Query answers over one loaded MatrixStore."""
+
+    def __init__(self, store):
+        self.store = store
+        digest = hashlib.sha1()
+        digest.update(json.dumps(store.names, ensure_ascii=False).encode("utf-8"))
+        digest.update(np.ascontiguousarray(store.durations).data)
+        digest.update(np.ascontiguousarray(store.distances).data)
+        self.version = digest.hexdigest()[:16]
+
+    def pos(self, name):
+        i = self.store.index.get(name)
+        if i is None:
+            raise QueryError(404, f"Unknown club: {name}")
+        return i
+
+    def entry(self, i, j):
+        sec = float(self.store.durations[i, j])
+        if not math.isfinite(sec):
+            return None
+        return make_entry(sec, float(self.store.distances[i, j]))
+
+    def line(self, i, direction):
+        """(durations, distances) of row i, or column i for direction 'in'."""
+        if direction == "out":
+            return self.store.durations[i], self.store.distances[i]
+        if direction == "in":
+            return self.store.durations[:, i], self.store.distances[:, i]
+        raise QueryError(400, "direction must be 'out' or 'in'")
+
+    def routes(self, indices, secs, metres):
+        names = self.store.names
+        return [{"club": names[j], **make_entry(s, m)}
+                for j, s, m in zip(indices, secs.tolist(), metres.tolist())]
+
+    def pair(self, src, dst):
+        i, j = self.pos(src), self.pos(dst)
+        return {"from": src, "to": dst, "route": self.entry(i, j),
+                "not_computed": bool(self.store.durations[i, j] == NOT_COMPUTED)}
+
+    def row(self, club, direction="out"):
+        durations, distances = self.line(self.pos(club), direction)
+        idx = np.flatnonzero(np.isfinite(durations))
+        return {"club": club, "direction": direction,
+                "routes": self.routes(idx.tolist(), durations[idx], distances[idx])}
+
+    def ranked(self, club, order):
+        i = self.pos(club)
+        return self.routes(order, self.store.durations[i, order], self.store.distances[i, order])
+
+    def nearest(self, club, k=10, direction="out"):
+        i = self.pos(club)
+        if direction == "out":
+            # Slice of the precomputed ranking
+            order = [j for j in self.store.ranking()[0][i, :max(0, k)].tolist() if j >= 0]
+            return {"club": club, "direction": direction, "k": len(order), "routes": self.ranked(club, order)}
+        durations, distances = self.line(i, direction)
+        candidates = np.flatnonzero(np.isfinite(durations))
+        candidates = candidates[candidates != i]
+        k = max(0, min(k, len(candidates)))
+        if k < len(candidates):
+            candidates = candidates[np.argpartition(durations[candidates], k)[:k]]
+        order = candidates[np.argsort(durations[candidates], kind="stable")]
+        return {"club": club, "direction": direction, "k": k,
+                "routes": self.routes(order.tolist(), durations[order], distances[order])}
+
+    def within(self, club, minutes):
+        self.pos(club)
+        order = [self.store.index[name] for name, _ in self.store.within(club, minutes)]
+        return {"club": club, "minutes": minutes, "routes": self.ranked(club, order)}
+
+    def batch(self, sources, destinations):
+        if not sources or not destinations:
+            raise QueryError(400, "batch needs at least one 'from' and one 'to' club")
+        src = np.array([self.pos(name) for name in sources], dtype=np.intp)
+        dst = np.array([self.pos(name) for name in destinations], dtype=np.intp)
+        # Same whole seconds as duration_sec of /pair and matrix.json
+        secs = whole_seconds_array(self.store.durations[np.ix_(src, dst)])
+        km = np.round(self.store.distances[np.ix_(src, dst)].astype(np.float64) / 1000, 1)
+
+        def rows(values, cast):
+            return [[cast(v) if math.isfinite(v) else None for v in row] for row in values.tolist()]
+
+        return {"from": list(sources), "to": list(destinations),
+                "duration_sec": rows(secs, int), "distance_km": rows(km, float)}
+
+    def answer(self, path, query):
+        """Response body (dict) for a GET path and parsed query."""
+        def one(name, default=None):
+            values = query.get(name)
+            if not values:
+                if default is None:
+                    raise QueryError(400, f"Missing parameter: {name}")
+                return default
+            return values[0]
+
+        if path == "/clubs":
+            return {"clubs": self.store.names}
+        if path == "/pair":
+            return self.pair(one("from"), one("to"))
+        if path == "/row":
+            return self.row(one("club"), one("direction", "out"))
+        if path == "/nearest":
+            try:
+                k = int(one("k", "10"))
+            except ValueError:
+                raise QueryError(400, "k must be an integer")
+            return self.nearest(one("club"), k, one("direction", "out"))
+        if path == "/within":
+            try:
+                minutes = int(one("minutes"))
+            except ValueError:
+                raise QueryError(400, "minutes must be an integer")
+            return self.within(one("club"), minutes)
+        if path == "/batch":
+            return self.batch(query.get("from", []), query.get("to", []))
+        raise QueryError(404, f"Unknown endpoint: {path}")
+
+    def etag(self, key):
+        return '"%s-%s"' % (self.version, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+
+
+class MatrixService:
+    """Shared response cache and counters; reloads the store when its files change."""
+
+    def __init__(self, data_dir="data", cache_size=10_000):
+        self.data_dir = Path(data_dir)
+        self.cache = LRUCache(cache_size)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "not_modified": 0, "errors": 0, "reloads": 0}
+        self.checked = 0.0
+        self.queries = None
+        self.load()
+
+    def _files_stamp(self):
+        store_dir = self.data_dir / STORE_DIR
+        return tuple((p.name, p.stat().st_mtime_ns, p.stat().st_size)
+                     for p in sorted(store_dir.glob("*")) if p.is_file() and p.suffix != ".tmp")
+
+    def load(self):
+        """Load the store; returns False (keeping the old one) while a save is half done."""
+        stamp = self._files_stamp()
+        store = MatrixStore.load(self.data_dir, mmap=False)
+        if store.durations.shape != (len(store), len(store)):
+            # MatrixStore.save() swaps in the arrays before names.json
+            if self.queries is not None:
+                return False
+            raise ValueError(f"{self.data_dir / STORE_DIR}: names.json does not match the arrays")
+        # Handlers take self.queries once per request, so swapping it is safe
+        self.queries = MatrixQueries(store)
+        self.stamp = stamp
+        self.cache.clear()
+        store = self.queries.store
+        print(f"Loaded {len(store)} clubs, {store.count()} routes (version {self.queries.version})")
+        return True
+
+    def current(self):
+        """MatrixQueries for the latest store, checking the files every few seconds."""
+        now = time.monotonic()
+        if now - self.checked >= RELOAD_CHECK_SECONDS:
+            with self.lock:
+                if now - self.checked >= RELOAD_CHECK_SECONDS:
+                    self.checked = now
+                    if self._files_stamp() != self.stamp and self.load():
+                        self.stats["reloads"] += 1
+        return self.queries
+
+    def counters(self):
+        with self.lock:
+            stats = dict(self.stats)
+        store = self.queries.store
+        stats.update(cache_entries=len(self.cache), cache_hits=self.cache.hits,
+                     cache_misses=self.cache.misses, version=self.queries.version,
+                     clubs=len(store), routes=store.count())
+        return stats
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive for tools doing many lookups
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    service = None  # set by make_server()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, payload, etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, error):
+        self.service.count("errors")
+        payload = json.dumps({"error": str(error)}, ensure_ascii=False).encode("utf-8")
+        self.send_body(error.status, payload)
+
+    def do_GET(self):
+        service = self.service
+        service.count("requests")
+        queries = service.current()
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/stats":
+            return self.send_body(200, json.dumps(service.counters()).encode("utf-8"))
+
+        query = urllib.parse.parse_qs(url.query)
+        key = url.path + "?" + urllib.parse.urlencode(sorted((k, v) for k, vs in query.items() for v in vs))
+        etag = queries.etag(key)
+        if etag in (tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")):
+            service.count("not_modified")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        cached = service.cache.get(etag)
+        if cached is None:
+            try:
+                cached = json.dumps(queries.answer(url.path, query), ensure_ascii=False).encode("utf-8")
+            except QueryError as e:
+                return self.send_error_json(e)
+            service.cache.put(etag, cached)
+        self.send_body(200, cached, etag)
+
+    def do_POST(self):
+        service = self.service
+        service.count("requests")
+        queries = service.current()
+        if urllib.parse.urlsplit(self.path).path != "/batch":
+            return self.send_error_json(QueryError(404, "Only /batch accepts POST"))
+        invalid = QueryError(400, "Body must be JSON with 'from' and 'to' lists of club names")
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self.send_error_json(invalid)
+        if not isinstance(body, dict):
+            return self.send_error_json(invalid)
+        sources, destinations = body.get("from", []), body.get("to", [])
+        if not all(isinstance(names, list) and all(isinstance(name, str) for name in names)
+                   for names in (sources, destinations)):
+            return self.send_error_json(invalid)
+        try:
+            answer = queries.batch(sources, destinations)
+        except QueryError as e:
+            return self.send_error_json(e)
+        self.send_body(200, json.dumps(answer, ensure_ascii=False).encode("utf-8"))
+
+
+def make_server(data_dir="data", host="127.0.0.1", port=8765, cache_size=10_000):
+    """Create (but do not start) a query server; port 0 picks a free port."""
+    service = MatrixService(data_dir, cache_size)
+    handler = type("ConfiguredQueryHandler", (QueryHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP query service over the driving matrix")
+    parser.add_argument("--data-dir", default=str(Path(__file__).parent / "data"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-size", type=int, default=10_000, help="Responses kept in the LRU cache")
+    args = parser.parse_args()
+
+    server = make_server(args.data_dir, args.host, args.port, args.cache_size)
+    print(f"Matrix query service listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
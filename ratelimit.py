@@ -0,0 +1,43 @@
+"""Thread-safe token-bucket rate limiter."""
+import threading
+import time
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second on average, bursts up to `burst`.
+
+    A rate of 0 or less disables limiting (pause() still holds callers back).
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available; returns the time waited in seconds."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate <= 0:
+                    return waited
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next `seconds` (e.g. a server's Retry-After)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
@@ -0,0 +1,106 @@
+"""
+Fill missing cells of the driving matrix without a full recompute.
+
+Finds (src, dst) pairs of clubs with coordinates that have no route in the
+matrix, covers them with as few Table requests as possible and patches
+only those cells. Coordinates come from data/coords.json, which
+fast_update.py and full_update.py write. --dry-run prints the requests a
+real run would make (same venue collapse and route cache, nothing is
+fetched). Finished tiles are journaled in their own file, so a repair
+never clears the tiles kept from a failed regular update.
+
+Usage:
+    python repair_matrix.py
+    python repair_matrix.py --dry-run
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import metrics
+from journal import JOURNAL_PATH, TileJournal
+from matrix_io import load_coords, save_matrix
+from matrix_store import MatrixStore
+from route_cache import CACHE_PATH, RouteCache
+from routing import backend_from_env
+from tiling import tile_scheduler_from_env
+
+REPAIR_JOURNAL_PATH = JOURNAL_PATH.with_name("repair_journal.jsonl")
+
+
+def find_missing(store, names):
+    """(i, j) index pairs over names with no route in the store."""
+    idx = [store.index[name] for name in names]
+    pos = {s: i for i, s in enumerate(idx)}
+    return [(pos[i], pos[j]) for i, j in store.missing_cells(idx, idx)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch only the missing cells of the driving matrix")
+    parser.add_argument("--data-dir", default=str(Path(__file__).parent / "data"))
+    parser.add_argument("--dry-run", action="store_true", help="Only report missing cells and the request plan")
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir)
+    report = metrics.start_report("repair_matrix", data_dir) if not args.dry_run else None
+    with open(data_dir / "clubs.json", "r", encoding="utf-8") as f:
+        clubs = json.load(f)
+    store = MatrixStore.load(data_dir)
+    coords = load_coords(data_dir)
+    if not coords:
+        sys.exit(f"No {data_dir / 'coords.json'}; run fast_update.py or full_update.py first")
+
+    club_names = [c["name"] for c in clubs]
+    store.reorder(club_names)
+    names = [name for name in club_names if name in coords]
+    if len(names) < len(club_names):
+        print(f"  {len(club_names) - len(names)} clubs without coordinates are skipped")
+    points = [coords[name] for name in names]
+
+    missing = find_missing(store, names)
+    print(f"  {len(missing)} missing cells of {len(names) * len(names)}")
+    if not missing:
+        print("Nothing to repair.")
+        return
+
+    backend = backend_from_env()
+    scheduler = tile_scheduler_from_env(backend)
+    if args.dry_run:
+        # Read the route cache only if there is one; a dry run creates nothing
+        route_cache = RouteCache() if CACHE_PATH.exists() else None
+        _, tiles = scheduler.plan_compute(points, cells=missing, cache=route_cache)
+        if route_cache is not None:
+            route_cache.close()
+        print(f"  Covered by {len(tiles)} Table requests ({backend.base_url})")
+        for tile in tiles:
+            print(f"    {tile}")
+        return
+
+    filled = 0
+    still_missing = set(missing)
+
+    def patch_cell(i, j, dur_sec, dist_m):
+        nonlocal filled
+        if dur_sec is not None and dist_m is not None:
+            store.set(store.index[names[i]], store.index[names[j]], dur_sec, dist_m)
+            still_missing.discard((i, j))
+            filled += 1
+
+    report.stage("matrix")
+    journal = TileJournal(REPAIR_JOURNAL_PATH)
+    route_cache = RouteCache()
+    failed = scheduler.compute(points, patch_cell, cells=missing, cache=route_cache, journal=journal)
+    route_cache.close()
+    if not failed:
+        journal.clear()
+
+    print(f"  Filled {filled} cells, {len(still_missing)} still missing")
+    if filled:
+        report.stage("save")
+        save_matrix(store, data_dir)
+    report.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Persistent route cache keyed by rounded coordinates and routing profile.
+
+Routes are stored under (profile, src lat/lon, dst lat/lon) rounded to
+5 decimals (about 1 m), not under club names. A renamed club, two clubs at
+the same venue, or a club moving back to an old address therefore reuse
+earlier results. The cache is a SQLite file bounded to max_entries rows;
+the least recently used rows are evicted first.
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import metrics
+
+CACHE_PATH = Path(__file__).parent / "cache" / "routes.sqlite"
+PRECISION = 5
+
+
+def _key(profile, src, dst):
+    return (profile,
+            round(src[0], PRECISION), round(src[1], PRECISION),
+            round(dst[0], PRECISION), round(dst[1], PRECISION))
+
+
+class RouteCache:
+    def __init__(self, path=CACHE_PATH, max_entries=2_000_000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS routes ("
+            " profile TEXT, src_lat REAL, src_lon REAL, dst_lat REAL, dst_lon REAL,"
+            " duration REAL, distance REAL, used REAL,"
+            " PRIMARY KEY (profile, src_lat, src_lon, dst_lat, dst_lon))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS routes_used ON routes (used)")
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+
+    def get_row(self, profile, src, dsts):
+        """Look up src -> each of dsts; returns a list of (seconds, metres) or None."""
+        key = _key(profile, src, src)[:3]
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT dst_lat, dst_lon, duration, distance FROM routes"
+                " WHERE profile=? AND src_lat=? AND src_lon=?", key).fetchall()
+            if rows:
+                # One query per source row; recency is tracked per row too
+                self.db.execute("UPDATE routes SET used=? WHERE profile=? AND src_lat=? AND src_lon=?",
+                                (time.time(),) + key)
+        known = {(lat, lon): (dur, dist) for lat, lon, dur, dist in rows}
+        found = [known.get((round(d[0], PRECISION), round(d[1], PRECISION))) for d in dsts]
+        hits = sum(1 for hit in found if hit is not None)
+        self.hits += hits
+        self.misses += len(found) - hits
+        metrics.count("route_cache.hits", hits)
+        metrics.count("route_cache.misses", len(found) - hits)
+        return found
+
+    def put_many(self, profile, routes):
+        """Store [(src, dst, seconds, metres), ...]; None values are skipped."""
+        now = time.time()
+        rows = [_key(profile, src, dst) + (dur, dist, now)
+                for src, dst, dur, dist in routes if dur is not None and dist is not None]
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def evict(self):
+        """Drop least recently used rows beyond max_entries; returns rows removed."""
+        with self.lock:
+            count = self.db.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+            excess = count - self.max_entries
+            if excess <= 0:
+                return 0
+            self.db.execute(
+                "DELETE FROM routes WHERE rowid IN (SELECT rowid FROM routes ORDER BY used LIMIT ?)",
+                (excess,))
+            self.db.commit()
+            return excess
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.db.commit()
+            self.db.close()
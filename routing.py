@@ -0,0 +1,119 @@
+"""
+Routing backend shared by fast_update.py and full_update.py.
+
+Talks to any OSRM-compatible server (the public demo server, our own OSRM,
+or the local stand-in in osrm_stub.py). Configure with environment vars:
+
+    OSRM_URL       base URL (default http://router.project-osrm.org)
+    OSRM_PROFILE   routing profile (default driving)
+    OSRM_TIMEOUT   request timeout in seconds (default 120)
+
+Example (offline run against the stand-in):
+    python osrm_stub.py --port 5000 &
+    OSRM_URL=http://127.0.0.1:5000 python full_update.py
+"""
+import json
+import math
+import os
+import time
+import urllib.error
+import urllib.request
+
+import metrics
+
+DEFAULT_URL = "http://router.project-osrm.org"
+USER_AGENT = "KoerselstidFodbold/1.0"
+
+
+def haversine_m(a, b):
+    """Great-circle distance in metres between two (lat, lon) points."""
+    lat1, lon1 = map(math.radians, a)
+    lat2, lon2 = map(math.radians, b)
+    h = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * 6371000 * math.asin(math.sqrt(h))
+
+
+class RoutingError(Exception):
+    """Raised when the routing server returns an error or bad response."""
+
+
+class OSRMBackend:
+    """Minimal client for the OSRM /table and /route services."""
+
+    def __init__(self, base_url=DEFAULT_URL, profile="driving", timeout=120):
+        self.base_url = base_url.rstrip("/")
+        self.profile = profile
+        self.timeout = timeout
+
+    @property
+    def id(self):
+        """Identifies the backend in caches and journals."""
+        return f"{self.base_url}/{self.profile}"
+
+    def _get(self, url, kind):
+        req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+        started = time.perf_counter()
+        body = b""
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                body = resp.read()
+                data = json.loads(body.decode())
+        except urllib.error.HTTPError as e:
+            # OSRM answers bad requests (TooBig, InvalidQuery, ...) with 400;
+            # those will not succeed on retry. Other statuses are re-raised.
+            if e.code != 400:
+                metrics.record(kind, time.perf_counter() - started, errors=1, url_chars=len(url))
+                raise
+            body = e.read()
+            try:
+                data = json.loads(body.decode())
+            except ValueError:
+                data = {"code": "InvalidUrl", "message": str(e)}
+        except Exception:
+            metrics.record(kind, time.perf_counter() - started, errors=1, url_chars=len(url))
+            raise
+        metrics.record(kind, time.perf_counter() - started, bytes=len(body), url_chars=len(url),
+                       errors=int(data.get("code") != "Ok"))
+        if data.get("code") != "Ok":
+            raise RoutingError(data.get("message", data.get("code", "Unknown")))
+        return data
+
+    def table_url(self, points, sources=None, destinations=None):
+        """Build a Table API URL; points is a list of (lat, lon)."""
+        coord_str = ";".join(f"{lon},{lat}" for lat, lon in points)
+        url = f"{self.base_url}/table/v1/{self.profile}/{coord_str}?annotations=duration,distance"
+        if sources is not None:
+            url += "&sources=" + ";".join(str(i) for i in sources)
+        if destinations is not None:
+            url += "&destinations=" + ";".join(str(i) for i in destinations)
+        return url
+
+    def table(self, points, sources=None, destinations=None):
+        """Query the Table API for sources x destinations.
+
+        sources and destinations are index lists into points (all if None).
+        Returns (durations, distances) as nested lists in seconds and metres,
+        with None where no route was found.
+        """
+        data = self._get(self.table_url(points, sources, destinations), "osrm.table")
+        return data["durations"], data["distances"]
+
+    def route(self, src, dst):
+        """Query the Route API for one (lat, lon) pair; returns (seconds, metres)."""
+        url = (f"{self.base_url}/route/v1/{self.profile}/"
+               f"{src[1]},{src[0]};{dst[1]},{dst[0]}?overview=false")
+        data = self._get(url, "osrm.route")
+        if not data.get("routes"):
+            raise RoutingError("No route")
+        route = data["routes"][0]
+        return route["duration"], route["distance"]
+
+
+def backend_from_env():
+    """Create the backend configured by OSRM_URL / OSRM_PROFILE / OSRM_TIMEOUT."""
+    return OSRMBackend(
+        base_url=os.environ.get("OSRM_URL", DEFAULT_URL),
+        profile=os.environ.get("OSRM_PROFILE", "driving"),
+        timeout=float(os.environ.get("OSRM_TIMEOUT", "120")),
+    )
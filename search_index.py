@@ -0,0 +1,90 @@
+"""
+Search index for the club autocomplete in index.html.
+
+Club names, cities and postal codes are folded and split into tokens:
+
+    fold()    lowercase, æ/ø/å as ae/oe/aa, other accents dropped, then
+              "aa" -> "a" and "oe" -> "o", so "Årslev", "Aarslev" and
+              "Arslev" or "Brøndby", "Broendby" and "Brondby" fold alike
+    tokens    runs of letters or digits ("B.1909" and "B1909" -> "b",
+              "1909"); in names also each two neighbouring tokens joined
+              ("b1909", "fc"), so abbreviations match with or without
+              spaces and dots
+
+data/search_index.json holds the sorted tokens, per token the clubs it
+occurs in, and trigrams of the longer tokens:
+
+    {"version", "count" (clubs in clubs.json),
+     "tokens":   sorted unique tokens,
+     "postings": per token [club index * 4 + field, ...] with clubs in
+                 clubs.json order and field 0 name, 1 city, 2 postal code,
+     "grams":    {trigram: [token index, ...]} for infix matches}
+
+A query token matches the tokens it is a prefix of (a binary search in
+"tokens"), or, when there are none, the tokens containing it (via
+"grams"). Every query token must match for a club to be listed.
+
+fold() must stay in sync with foldSearch() in index.html. save_clubs()
+rewrites the index with clubs.json.
+"""
+import json
+import re
+import unicodedata
+from pathlib import Path
+
+INDEX_VERSION = 1
+FIELDS = ("name", "city", "postal_code")
+GRAM = 3
+
+
+def fold(text):
+    """Lowercase text with Danish letters and accents folded (see the module docstring)."""
+    text = (text or "").lower().replace("æ", "ae").replace("ø", "oe").replace("å", "aa")
+    text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+    return text.replace("aa", "a").replace("oe", "o")
+
+
+def split_tokens(text):
+    """Folded runs of letters or digits of text."""
+    return re.findall(r"[^\W\d_]+|\d+", fold(text))
+
+
+def club_tokens(club):
+    """{token: field} of a club; a token in several fields keeps the lowest field."""
+    found = {}
+    for field, key in enumerate(FIELDS):
+        parts = split_tokens(club.get(key))
+        if key == "name":
+            parts += [a + b for a, b in zip(parts, parts[1:])]
+        for token in parts:
+            found.setdefault(token, field)
+    return found
+
+
+def build_search_index(clubs):
+    postings = {}
+    for i, club in enumerate(clubs):
+        for token, field in club_tokens(club).items():
+            postings.setdefault(token, []).append(i * 4 + field)
+    tokens = sorted(postings)
+    grams = {}
+    for t, token in enumerate(tokens):
+        if token.isdigit():
+            continue
+        for gram in {token[k:k + GRAM] for k in range(len(token) - GRAM + 1)}:
+            grams.setdefault(gram, []).append(t)
+    return {
+        "version": INDEX_VERSION,
+        "count": len(clubs),
+        "tokens": tokens,
+        "postings": [postings[token] for token in tokens],
+        "grams": dict(sorted(grams.items())),
+    }
+
+
+def write_search_index(clubs, data_dir):
+    """Write data_dir/search_index.json for clubs (in clubs.json order); returns its path."""
+    path = Path(data_dir) / "search_index.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(build_search_index(clubs), f, ensure_ascii=False, separators=(",", ":"))
+    return path
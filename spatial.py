@@ -0,0 +1,35 @@
+"""
+Find pairs of clubs within a straight-line radius of each other.
+
+Used by the opt-in radius mode (MATRIX_RADIUS_KM, see matrix_update.py):
+only these pairs are routed, so routing cost grows with the number of
+neighbours per club instead of with the square of the club count.
+"""
+import math
+
+from routing import haversine_m
+
+
+def pairs_within(points, radius_m):
+    """(i, j) index pairs with i < j whose points lie within radius_m.
+
+    Points are bucketed in a grid with cells at least radius_m wide, so
+    each point is only compared with the points in its 3x3 block.
+    """
+    if not points:
+        return []
+    cell_lat = radius_m / 111_320
+    min_cos = min(math.cos(math.radians(p[0])) for p in points)
+    cell_lon = radius_m / (111_320 * max(0.01, min_cos))
+    grid = {}
+    for i, p in enumerate(points):
+        grid.setdefault((int(p[0] // cell_lat), int(p[1] // cell_lon)), []).append(i)
+
+    pairs = []
+    for (cy, cx), members in grid.items():
+        neighbours = [j for dy in (-1, 0, 1) for dx in (-1, 0, 1) for j in grid.get((cy + dy, cx + dx), ())]
+        for i in members:
+            for j in neighbours:
+                if i < j and haversine_m(points[i], points[j]) <= radius_m:
+                    pairs.append((i, j))
+    return pairs
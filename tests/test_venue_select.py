@@ -0,0 +1,32 @@
+import numpy as np
+
+from matrix_store import MatrixStore
+from venue_select import VenueSelector
+
+N = 12
+NAMES = [f"Klub {i}" for i in range(N)]
+# The first set is wider, so the second one is padded
+SETS = [NAMES[1:4], NAMES[4:6]]
+
+
+def make_selector(missing=()):
+    """Selector over N clubs on a line, 100 s apart plus 1000 s, without routes for missing."""
+    idx = np.arange(N)
+    durations = (np.abs(idx[:, None] - idx[None, :]) * 100 + 1000).astype(np.float32)
+    np.fill_diagonal(durations, 0)
+    for i, j in missing:
+        durations[i, j] = np.nan
+    return VenueSelector(MatrixStore(NAMES, durations, durations * 10))
+
+
+def test_percentile_padding_ignores_club_zero_routes():
+    selector = make_selector(missing=[(0, 10)])
+    scores = selector.score(SETS, objective="percentile", percentile=50)
+    assert scores[1, 10] == np.percentile(selector.times[[4, 5], 10], 50)
+
+
+def test_percentile_blocks_host_without_route_from_a_team():
+    selector = make_selector(missing=[(4, 10)])
+    scores = selector.score(SETS, objective="percentile", percentile=50)
+    assert scores[1, 10] == np.inf
+    assert np.isfinite(scores[1, 9])
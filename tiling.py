@@ -0,0 +1,371 @@
+"""
+Tiling scheduler for OSRM Table requests.
+
+Splits a sources x destinations matrix into tiles that fit the server's
+coordinate and URL limits, sends only the coordinates each tile needs,
+runs tiles concurrently under a shared rate limit, and hands each finished
+tile back to the caller for reassembly. Finished tiles can be recorded in
+a TileJournal (journal.py) so an interrupted run resumes where it stopped.
+
+Configured with environment variables (see tile_scheduler_from_env):
+
+    OSRM_MAX_COORDS    max coordinates per request (default 200)
+    OSRM_MAX_URL       max URL length in characters (default 8000)
+    OSRM_WORKERS       concurrent requests (default 2)
+    OSRM_RATE          max requests per second (default 0.5; 0 = unlimited)
+    VENUE_TOLERANCE_M  clubs closer than this many metres share one routing
+                       location (default 25; 0 = identical coordinates only)
+"""
+import heapq
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+from journal import tile_key
+from ratelimit import TokenBucket
+from routing import RoutingError
+from venues import collapse_venues
+
+
+class Tile:
+    """One Table request: global source and destination index lists.
+
+    cells, if given, is the set of (src, dst) cells this tile answers;
+    tiles of a sparse plan overlap, and each wanted cell is answered by
+    exactly one of them.
+    """
+
+    def __init__(self, sources, destinations, cells=None):
+        self.sources = list(sources)
+        self.destinations = list(destinations)
+        self.cells_answered = None if cells is None else set(cells)
+
+    def __repr__(self):
+        return f"Tile({len(self.sources)}x{len(self.destinations)})"
+
+    def request(self, points):
+        """Local points plus local source/destination indices for this tile."""
+        order = list(dict.fromkeys(self.sources + self.destinations))
+        local = {g: i for i, g in enumerate(order)}
+        return ([points[g] for g in order],
+                [local[g] for g in self.sources],
+                [local[g] for g in self.destinations])
+
+    def cells(self, durations, distances):
+        """Yield (src, dst, seconds, metres) with global indices."""
+        for si, src in enumerate(self.sources):
+            dur_row = durations[si]
+            dist_row = distances[si]
+            for di, dst in enumerate(self.destinations):
+                yield src, dst, dur_row[di], dist_row[di]
+
+
+def chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class TileScheduler:
+    def __init__(self, backend, max_coords=200, max_url=8000, workers=2, rate=0.5,
+                 retries=3, backoff=10, venue_tolerance=25):
+        self.backend = backend
+        self.venue_tolerance = venue_tolerance
+        self.max_coords = max_coords
+        self.max_url = max_url
+        self.workers = max(1, workers)
+        self.limiter = TokenBucket(rate, burst=self.workers)
+        self.retries = retries
+        self.backoff = backoff
+
+    def coord_budget(self, points):
+        """Max coordinates per request allowed by both the count and URL limits."""
+        if not points:
+            return self.max_coords
+        base = len(self.backend.table_url([], [], []))
+        coord_chars = max(len(f"{lon},{lat};") for lat, lon in points)
+        index_chars = len(str(self.max_coords)) + 1
+        # Each coordinate appears once in the path and, when it is both a
+        # source and a destination, in both index lists
+        by_url = (self.max_url - base) // (coord_chars + 2 * index_chars)
+        return max(2, min(self.max_coords, by_url))
+
+    def plan(self, points, sources=None, destinations=None):
+        """Split sources x destinations (all points if None) into tiles."""
+        sources = list(range(len(points))) if sources is None else list(sources)
+        destinations = list(range(len(points))) if destinations is None else list(destinations)
+        if not sources or not destinations:
+            return []
+        budget = self.coord_budget(points)
+
+        if len(set(sources) | set(destinations)) <= budget:
+            return [Tile(sources, destinations)]
+        # Give a short side its full length, otherwise use square tiles
+        if len(sources) <= budget // 2:
+            src_size, dst_size = len(sources), budget - len(sources)
+        elif len(destinations) <= budget // 2:
+            src_size, dst_size = budget - len(destinations), len(destinations)
+        else:
+            src_size = dst_size = budget // 2
+        return [Tile(s, d) for s in chunks(sources, src_size) for d in chunks(destinations, dst_size)]
+
+    def plan_cells(self, points, cells):
+        """Cover a sparse set of (src, dst) cells with as few tiles as possible.
+
+        Compares a dense plan over every row and column that has a wanted
+        cell with a greedy row/column cover whose lines are packed into
+        tiles, and returns whichever needs fewer requests. Tiles may
+        include cells that were not asked for.
+        """
+        cells = set(cells)
+        if not cells:
+            return []
+        budget = self.coord_budget(points)
+        rows, cols = {}, {}
+        for i, j in cells:
+            rows.setdefault(i, set()).add(j)
+            cols.setdefault(j, set()).add(i)
+        dense = self.plan(points, sorted(rows), sorted(cols))
+
+        # Greedy line cover: repeatedly take the row or column covering the
+        # most uncovered cells (lazy max-heap keyed by current count).
+        heap = [(-len(v), "r", k) for k, v in rows.items()] + [(-len(v), "c", k) for k, v in cols.items()]
+        heapq.heapify(heap)
+        row_lines, col_lines = [], []
+        while heap:
+            neg, kind, k = heapq.heappop(heap)
+            line = rows[k] if kind == "r" else cols[k]
+            if not line:
+                continue
+            if len(line) != -neg:
+                heapq.heappush(heap, (-len(line), kind, k))
+                continue
+            if kind == "r":
+                row_lines.append((k, set(line)))
+                for j in line:
+                    cols[j].discard(k)
+                rows[k] = set()
+            else:
+                col_lines.append((k, set(line)))
+                for i in line:
+                    rows[i].discard(k)
+                cols[k] = set()
+
+        # The lines partition the cells, so each tile answers the cells of its own lines
+        tiles = [Tile(s, d, [(k, j) for k, line in owned for j in line])
+                 for s, d, owned in self._pack(row_lines, budget)]
+        tiles += [Tile(s, d, [(i, k) for k, line in owned for i in line])
+                  for d, s, owned in self._pack(col_lines, budget)]
+        if len(tiles) < len(dense):
+            return tiles
+        # Dense tiles do not overlap; each answers the wanted cells inside it
+        by_row = {}
+        for tile in dense:
+            tile.cells_answered = set()
+            for i in tile.sources:
+                by_row.setdefault(i, []).append((set(tile.destinations), tile))
+        for i, j in cells:
+            next(tile for dsts, tile in by_row[i] if j in dsts).cells_answered.add((i, j))
+        return dense
+
+    @staticmethod
+    def _pack(lines, budget):
+        """First-fit pack (key, cells) lines into (keys, cells, [(key, line cells)]) groups within budget."""
+        groups = []
+        for key, others in sorted(lines, key=lambda line: -len(line[1])):
+            others = sorted(others)
+            if len(others) >= budget:
+                for part in chunks(others, budget - 1):
+                    groups.append(([key], part, [(key, part)]))
+                continue
+            for keys, group, owned in groups:
+                merged = set(group) | set(others)
+                if len(set(keys) | merged | {key}) <= budget:
+                    keys.append(key)
+                    group[:] = sorted(merged)
+                    owned.append((key, others))
+                    break
+            else:
+                groups.append(([key], list(others), [(key, others)]))
+        return groups
+
+    def fetch(self, points, tile):
+        """Fetch one tile with rate limiting and retries; returns (durations, distances)."""
+        tile_points, src, dst = tile.request(points)
+        for attempt in range(self.retries):
+            metrics.count("osrm.rate_limit_wait_s", self.limiter.acquire())
+            try:
+                return self.backend.table(tile_points, src, dst)
+            except RoutingError:
+                raise
+            except Exception:
+                if attempt == self.retries - 1:
+                    raise
+                metrics.count("osrm.retries")
+                metrics.count("osrm.backoff_s", self.backoff * (attempt + 1))
+                time.sleep(self.backoff * (attempt + 1))
+
+    def compute(self, points, on_cell, sources=None, destinations=None, cells=None,
+                cache=None, journal=None):
+        """Route sources x destinations (or an explicit list of cells).
+
+        Points within venue_tolerance metres of each other are routed once
+        (see venues.py) and the result is fanned out to every club there.
+        Cells found in the RouteCache are answered without a request; the
+        rest are tiled, fetched, stored in the cache and passed on.
+        on_cell(src, dst, seconds, metres) is called exactly once per wanted
+        cell that was answered (values may be None where there is no route).
+        Returns the list of failed tiles.
+        """
+        points, on_cell, sources, destinations, cells = self._by_venue(
+            points, on_cell, sources, destinations, cells)
+        tiles, on_tile = self._plan_unique(points, on_cell, sources, destinations, cells, cache)
+        return self.run(points, tiles, on_tile, journal=journal)
+
+    def plan_compute(self, points, sources=None, destinations=None, cells=None, cache=None):
+        """(points, tiles) that compute() would request with the same arguments.
+
+        Nothing is fetched. The tiles index into the returned points, which
+        are the venues when clubs share one (see compute()).
+        """
+        points, on_cell, sources, destinations, cells = self._by_venue(
+            points, lambda *args: None, sources, destinations, cells)
+        tiles, _ = self._plan_unique(points, on_cell, sources, destinations, cells, cache)
+        return points, tiles
+
+    def _by_venue(self, points, on_cell, sources, destinations, cells):
+        """The same problem over venue points, with on_cell fanning results out to clubs."""
+        venue_points, venue_of = collapse_venues(points, self.venue_tolerance)
+        if len(venue_points) == len(points):
+            return points, on_cell, sources, destinations, cells
+        print(f"    {len(points)} clubs share {len(venue_points)} venues")
+
+        # Map wanted club cells onto venue cells, remembering who to fan out to
+        if cells is None:
+            sources = range(len(points)) if sources is None else sources
+            destinations = range(len(points)) if destinations is None else destinations
+            src_members, dst_members = {}, {}
+            for i in sources:
+                src_members.setdefault(venue_of[i], []).append(i)
+            for j in destinations:
+                dst_members.setdefault(venue_of[j], []).append(j)
+
+            def fan_out(vi, vj, dur, dist):
+                for i in src_members[vi]:
+                    for j in dst_members[vj]:
+                        on_cell(i, j, dur, dist)
+
+            return venue_points, fan_out, list(src_members), list(dst_members), None
+
+        members = {}
+        for i, j in cells:
+            members.setdefault((venue_of[i], venue_of[j]), []).append((i, j))
+
+        def fan_out_cells(vi, vj, dur, dist):
+            for i, j in members[vi, vj]:
+                on_cell(i, j, dur, dist)
+
+        return venue_points, fan_out_cells, None, None, list(members)
+
+    def _plan_unique(self, points, on_cell, sources, destinations, cells, cache):
+        """(tiles, on_tile) for distinct points; cells found in the cache go to on_cell now."""
+        if cells is None:
+            sources = range(len(points)) if sources is None else sources
+            destinations = list(range(len(points))) if destinations is None else list(destinations)
+            shared = set(destinations)
+            wanted = {i: shared for i in sources}
+            order = {i: destinations for i in sources}
+        else:
+            wanted, order = {}, {}
+            for i, j in cells:
+                if j not in wanted.setdefault(i, set()):
+                    wanted[i].add(j)
+                    order.setdefault(i, []).append(j)
+
+        full_rows, partial = [], []
+        for i, dsts in order.items():
+            hits = None
+            if cache is not None:
+                hits = cache.get_row(self.backend.id, points[i], [points[j] for j in dsts])
+            if not hits or not any(hits):
+                if cells is None:
+                    full_rows.append(i)
+                else:
+                    partial.extend((i, j) for j in dsts)
+                continue
+            for j, hit in zip(dsts, hits):
+                if hit is None:
+                    partial.append((i, j))
+                else:
+                    on_cell(i, j, *hit)
+        if cache is not None:
+            print(f"    Route cache: {cache.hits} hits, {cache.misses} misses")
+
+        tiles = self.plan(points, full_rows, destinations) if full_rows else []
+        tiles += self.plan_cells(points, partial)
+        print(f"    {len(tiles)} Table requests (max {self.coord_budget(points)} coordinates, "
+              f"{self.workers} workers)")
+
+        def on_tile(tile, durations, distances):
+            if cache is not None:
+                cache.put_many(self.backend.id, [(points[i], points[j], dur, dist)
+                                                 for i, j, dur, dist in tile.cells(durations, distances)])
+            answered = tile.cells_answered
+            for i, j, dur, dist in tile.cells(durations, distances):
+                if (j in wanted.get(i, ())) if answered is None else ((i, j) in answered):
+                    on_cell(i, j, dur, dist)
+
+        return tiles, on_tile
+
+    def run(self, points, tiles, on_tile, journal=None):
+        """Fetch tiles concurrently and call on_tile(tile, durations, distances).
+
+        on_tile is called from the calling thread. With a TileJournal, tiles
+        already in the journal are replayed without a request and each newly
+        finished tile is appended as soon as it arrives. Returns the list of
+        tiles that failed after all retries.
+        """
+        failed = []
+        pending = {}
+        for tile in tiles:
+            key = tile_key(self.backend.id, points, tile) if journal is not None else None
+            cached = journal.get(key) if journal is not None else None
+            if cached is not None:
+                on_tile(tile, *cached)
+            else:
+                pending[key, id(tile)] = tile
+        if journal is not None and len(pending) < len(tiles):
+            print(f"    {len(tiles) - len(pending)}/{len(tiles)} tiles resumed from journal")
+        if not pending:
+            return failed
+
+        started = time.monotonic()
+        report_every = max(1, len(pending) // 20)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.fetch, points, tile): (key, tile)
+                       for (key, _), tile in pending.items()}
+            for done, future in enumerate(as_completed(futures), 1):
+                key, tile = futures[future]
+                try:
+                    durations, distances = future.result()
+                except Exception as e:
+                    print(f"    WARNING: {tile} failed: {e}")
+                    failed.append(tile)
+                    continue
+                if journal is not None:
+                    journal.append(key, durations, distances)
+                on_tile(tile, durations, distances)
+                if done % report_every == 0 or done == len(pending):
+                    print(f"    {done}/{len(pending)} tiles done ({time.monotonic() - started:.1f}s)")
+        return failed
+
+
+def tile_scheduler_from_env(backend):
+    """Create a TileScheduler configured by the OSRM_* environment variables."""
+    return TileScheduler(
+        backend,
+        max_coords=int(os.environ.get("OSRM_MAX_COORDS", "200")),
+        max_url=int(os.environ.get("OSRM_MAX_URL", "8000")),
+        workers=int(os.environ.get("OSRM_WORKERS", "2")),
+        rate=float(os.environ.get("OSRM_RATE", "0.5")),
+        venue_tolerance=float(os.environ.get("VENUE_TOLERANCE_M", "25")),
+    )
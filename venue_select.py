@@ -0,0 +1,206 @@
+"""
+Pick the best host club for a tournament or meeting from the driving matrix.
+
+For a set of teams, every candidate host is scored by the driving time of
+the teams to it (the columns of the matrix), with one of the objectives:
+
+    sum         total driving time of all teams
+    max         driving time of the team furthest away
+    percentile  the p-th percentile of the teams' driving times
+                (linear interpolation, like numpy.percentile)
+
+Many team sets are scored at once: the sets are padded into one index
+array and each chunk of sets is a single gather from the matrix, so all
+hosts of all sets are scored without Python loops over clubs. A host with
+no known route from one of the teams (missing or not computed in radius
+mode) is never picked for that set.
+
+Python:
+    selector = VenueSelector.load("data")
+    selector.best([["Aarup BK", "Assens FC", "Tommerup BK"]], objective="max", top=3)
+
+CLI:
+    python venue_select.py --team "Aarup BK" --team "Assens FC" --team "Tommerup BK"
+    python venue_select.py --sets team_sets.json --objective percentile --percentile 90 --json
+
+team_sets.json is a list of team lists, or {label: [teams]}.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from matrix_io import format_duration
+from matrix_store import MatrixStore
+
+OBJECTIVES = ("sum", "max", "percentile")
+# Upper bound on gathered cells (sets x teams x hosts) per chunk, ~64 MB as float32
+CHUNK_CELLS = 16_000_000
+
+
+class VenueSelector:
+    """Scores candidate hosts for sets of teams over a MatrixStore."""
+
+    def __init__(self, store):
+        self.store = store
+        times = np.asarray(store.durations, dtype=np.float32)
+        # Missing (NaN) and not computed (inf) both rule a host out
+        self.times = np.where(np.isfinite(times), times, np.float32(np.inf))
+
+    @classmethod
+    def load(cls, data_dir="data"):
+        return cls(MatrixStore.load(data_dir))
+
+    def _index(self, team_sets):
+        """(idx, valid) arrays of shape (sets, max set size); unknown clubs raise ValueError."""
+        if not team_sets:
+            raise ValueError("No team sets given")
+        width = max(len(teams) for teams in team_sets)
+        idx = np.zeros((len(team_sets), width), dtype=np.intp)
+        valid = np.zeros((len(team_sets), width), dtype=bool)
+        for q, teams in enumerate(team_sets):
+            if not teams:
+                raise ValueError(f"Team set {q + 1} is empty")
+            for k, name in enumerate(teams):
+                if name not in self.store.index:
+                    raise ValueError(f"Unknown club: {name}")
+                idx[q, k] = self.store.index[name]
+            valid[q, :len(teams)] = True
+        return idx, valid
+
+    def score(self, team_sets, objective="sum", percentile=90, hosts=None, among_teams=False):
+        """Seconds per (team set, host) as a (sets, clubs) float64 array.
+
+        Hosts are columns in store order; inf marks hosts that are not
+        allowed (not in hosts, not one of the teams when among_teams is
+        set, or without a route from one of the teams).
+        """
+        if objective not in OBJECTIVES:
+            raise ValueError(f"objective must be one of {', '.join(OBJECTIVES)}")
+        if not 0 <= percentile <= 100:
+            raise ValueError("percentile must be between 0 and 100")
+        idx, valid = self._index(team_sets)
+        n_sets, width = idx.shape
+        n = len(self.store)
+        sizes = valid.sum(axis=1)
+        scores = np.empty((n_sets, n), dtype=np.float64)
+
+        step = max(1, CHUNK_CELLS // max(1, width * n))
+        for start in range(0, n_sets, step):
+            part = slice(start, start + step)
+            travel = self.times[idx[part]]  # (sets, teams, hosts): team -> host
+            pad = ~valid[part]
+            if objective == "sum":
+                travel[pad] = 0
+                scores[part] = travel.sum(axis=1, dtype=np.float64)
+            elif objective == "max":
+                travel[pad] = 0
+                scores[part] = travel.max(axis=1)
+            else:
+                # Padding slots gather club 0's row, so only real teams can block a host
+                blocked = (np.isinf(travel) & valid[part][:, :, None]).any(axis=1)
+                travel[pad] = np.inf
+                travel.sort(axis=1)  # padding sorts last
+                rank = (sizes[part] - 1) * (percentile / 100)
+                lo = np.floor(rank).astype(np.intp)
+                hi = np.minimum(lo + 1, sizes[part] - 1)
+                frac = (rank - lo)[:, None]
+                low = np.take_along_axis(travel, lo[:, None, None], axis=1)[:, 0].astype(np.float64)
+                high = np.take_along_axis(travel, hi[:, None, None], axis=1)[:, 0].astype(np.float64)
+                with np.errstate(invalid="ignore"):
+                    value = np.where(frac > 0, low + (high - low) * frac, low)
+                value[blocked] = np.inf
+                scores[part] = value
+
+        if hosts is not None:
+            allowed = np.zeros(n, dtype=bool)
+            allowed[[self.store.index[name] for name in hosts if name in self.store.index]] = True
+            scores[:, ~allowed] = np.inf
+        if among_teams:
+            member = np.zeros((n_sets, n), dtype=bool)
+            member[np.repeat(np.arange(n_sets), width)[valid.ravel()], idx[valid]] = True
+            scores[~member] = np.inf
+        return scores
+
+    def best(self, team_sets, objective="sum", percentile=90, top=3, hosts=None, among_teams=False):
+        """Top hosts per team set, best first.
+
+        Returns one dict per set: {"teams": [...], "hosts": [{"club",
+        "seconds", "text"}, ...]}; "hosts" is empty when no host has a
+        route from every team.
+        """
+        team_sets = [list(teams) for teams in team_sets]
+        scores = self.score(team_sets, objective, percentile, hosts, among_teams)
+        k = max(0, min(top, scores.shape[1]))
+        if k < scores.shape[1]:
+            candidates = np.argpartition(scores, k, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        chosen = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(chosen, axis=1, kind="stable")
+        candidates = np.take_along_axis(candidates, order, axis=1)
+
+        names = self.store.names
+        results = []
+        for teams, row, host_idx in zip(team_sets, scores, candidates.tolist()):
+            results.append({"teams": teams, "hosts": [
+                {"club": names[j], "seconds": round(float(row[j]), 1), "text": format_duration(row[j])}
+                for j in host_idx if np.isfinite(row[j])]})
+        return results
+
+
+def read_team_sets(path):
+    """[(label, teams)] from a JSON list of team lists or {label: [teams]}."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return list(data.items())
+    return [(f"Set {i + 1}", teams) for i, teams in enumerate(data)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the host club with the least driving for a set of teams")
+    parser.add_argument("--data-dir", default=str(Path(__file__).parent / "data"))
+    parser.add_argument("--team", action="append", default=[], help="Club in the team set (repeat)")
+    parser.add_argument("--sets", help="JSON file with many team sets")
+    parser.add_argument("--objective", choices=OBJECTIVES, default="sum")
+    parser.add_argument("--percentile", type=float, default=90, help="Percentile for --objective percentile")
+    parser.add_argument("--top", type=int, default=3, help="Hosts to list per team set")
+    parser.add_argument("--host", action="append", help="Only consider these hosts (repeat)")
+    parser.add_argument("--among-teams", action="store_true", help="Host must be one of the teams")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args()
+
+    labelled = read_team_sets(args.sets) if args.sets else []
+    if args.team:
+        labelled.append(("Teams", args.team))
+    if not labelled:
+        parser.error("give --team at least once or --sets")
+
+    selector = VenueSelector.load(args.data_dir)
+    started = time.perf_counter()
+    try:
+        results = selector.best([teams for _, teams in labelled], args.objective, args.percentile,
+                                args.top, args.host, args.among_teams)
+    except ValueError as e:
+        sys.exit(f"ERROR: {e}")
+    elapsed = time.perf_counter() - started
+
+    if args.json:
+        print(json.dumps([{"label": label, **result} for (label, _), result in zip(labelled, results)],
+                         ensure_ascii=False, indent=1))
+        return
+    for (label, teams), result in zip(labelled, results):
+        print(f"{label} ({len(teams)} teams, {args.objective}):")
+        if not result["hosts"]:
+            print("  no host has a route from every team")
+        for rank, host in enumerate(result["hosts"], 1):
+            print(f"  {rank}. {host['club']:<35} {host['text']}")
+    print(f"\n{len(results)} team sets x {len(selector.store)} hosts scored in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
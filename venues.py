@@ -0,0 +1,55 @@
+"""
+Collapse clubs that share a venue into unique routing locations.
+
+Many clubs play at the same grounds (KNOWN_COORDS notes that DBU Fyn uses
+BK2020's coordinates). Routing each of them separately repeats identical
+rows and columns, so the matrix is routed over unique venues and the
+results are fanned back out to every club at that venue.
+"""
+import math
+
+from routing import haversine_m
+
+
+def collapse_venues(points, tolerance_m=25):
+    """Group (lat, lon) points lying within tolerance_m of an earlier venue.
+
+    Returns (venue_points, venue_of) where venue_of[i] is the venue index
+    of points[i]. A tolerance of 0 only merges identical coordinates.
+    """
+    venue_points = []
+    venue_of = []
+    if tolerance_m <= 0:
+        seen = {}
+        for p in points:
+            key = (p[0], p[1])
+            if key not in seen:
+                seen[key] = len(venue_points)
+                venue_points.append(p)
+            venue_of.append(seen[key])
+        return venue_points, venue_of
+
+    # Grid with cells at least tolerance_m wide, so matches are in the 3x3 block
+    cell_lat = tolerance_m / 111_320
+    min_cos = min((math.cos(math.radians(p[0])) for p in points), default=1.0)
+    cell_lon = tolerance_m / (111_320 * max(0.01, min_cos))
+    grid = {}
+    for p in points:
+        cy, cx = int(p[0] // cell_lat), int(p[1] // cell_lon)
+        match = None
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                for v in grid.get((cy + dy, cx + dx), ()):
+                    if haversine_m(p, venue_points[v]) <= tolerance_m:
+                        match = v
+                        break
+                if match is not None:
+                    break
+            if match is not None:
+                break
+        if match is None:
+            match = len(venue_points)
+            venue_points.append(p)
+            grid.setdefault((cy, cx), []).append(match)
+        venue_of.append(match)
+    return venue_points, venue_of